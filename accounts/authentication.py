@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from config.metrics import staged
+from .models import User
+"""
+JWT authentication with a cache of validated tokens
+
+A verified access token maps to its user for a short TTL (never past the token's own `exp`),
+so repeated requests with the same token skip signature verification and the `auth_user` query.
+"""
+
+
+class TokenUserCache:
+    """ In-process LRU of raw token -> (user, validated token)
+
+    Entries live for `ttl` seconds at most and never outlive the token. Saving or deleting
+    a user drops the entries of that user in this process; other web processes keep serving
+    their cached user (e.g. a deactivated one) for up to `ttl` seconds.
+
+    Args:
+        ttl (int): entry lifetime in seconds
+        max_size (int): maximum number of cached tokens
+    """
+    def __init__(self, ttl: int = 60, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}  # user id -> raw tokens, so forgetting a user is not a scan
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get(self, raw_token: bytes):
+        with self._lock:
+            entry = self._entries.get(raw_token)
+            if entry is not None:
+                user, validated_token, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(raw_token)
+                    self._stats['hits'] += 1
+                    return user, validated_token
+                self._remove(raw_token)
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, raw_token: bytes, user, validated_token):
+        lifetime = min(self.ttl, validated_token.get('exp', 0) - time.time())
+        if lifetime <= 0:
+            return
+        with self._lock:
+            if raw_token in self._entries:
+                self._remove(raw_token)
+            self._entries[raw_token] = (user, validated_token, time.monotonic() + lifetime)
+            self._tokens_by_user.setdefault(user.pk, set()).add(raw_token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, raw_token: bytes):
+        # caller holds the lock
+        user, _, _ = self._entries.pop(raw_token)
+        tokens = self._tokens_by_user.get(user.pk)
+        if tokens is not None:
+            tokens.discard(raw_token)
+            if not tokens:
+                del self._tokens_by_user[user.pk]
+
+    def forget_user(self, user_id: int):
+        with self._lock:
+            for raw_token in self._tokens_by_user.pop(user_id, ()):
+                del self._entries[raw_token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+token_cache = TokenUserCache(ttl=settings.JWT_USER_CACHE_TTL, max_size=settings.JWT_USER_CACHE_SIZE)
+
+
+def _forget_user(sender, instance, **kwargs):
+    token_cache.forget_user(instance.pk)
+
+
+post_save.connect(_forget_user, sender=User, dispatch_uid='token_cache_user_saved')
+post_delete.connect(_forget_user, sender=User, dispatch_uid='token_cache_user_deleted')
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ JWTAuthentication backed by `token_cache` (used by every API view and the websocket middleware) """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        return self.authenticate_token(raw_token)
+
+    @staged('auth')
+    def authenticate_token(self, raw_token: bytes) -> tuple:
+        cached = token_cache.get(raw_token)
+        if cached is not None:
+            return cached
+
+        validated_token = self.get_validated_token(raw_token)
+        user = self.get_user(validated_token)
+        token_cache.set(raw_token, user, validated_token)
+        return user, validated_token
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, get_hasher, identify_hasher, make_password
+from rest_framework.exceptions import Throttled
+"""
+Password hashing for the login path
+
+Hashing runs in a bounded thread pool (hashlib's PBKDF2 releases the GIL, so workers hash
+in parallel) and logins beyond PASSWORD_HASH_MAX_PENDING in-flight hashes are shed with 429.
+The login view awaits the hashes (arun_hashing), so a waiting login holds no request thread.
+"""
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """ PBKDF2 with the iteration count taken from settings.PASSWORD_HASH_ITERATIONS
+
+    Uses the same algorithm name as Django's hasher, so existing hashes stay valid and are
+    upgraded (or downgraded) to the configured iteration count on the next successful login.
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _pending
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _pending = threading.BoundedSemaphore(settings.PASSWORD_HASH_MAX_PENDING)
+                _executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+    return _executor
+
+
+def run_hashing(func, *args):
+    """ Runs a hashing function in the pool and waits for the result
+
+    Raises:
+        Throttled: when PASSWORD_HASH_MAX_PENDING hashes are already queued or running
+    """
+    executor = _get_executor()
+    if not _pending.acquire(blocking=False):
+        raise Throttled(detail='Too many login attempts in progress, try again later.')
+    try:
+        return executor.submit(func, *args).result()
+    finally:
+        _pending.release()
+
+
+async def arun_hashing(func, *args):
+    """ Async version of run_hashing: the caller awaits the pool without blocking a thread
+
+    Raises:
+        Throttled: when PASSWORD_HASH_MAX_PENDING hashes are already queued or running
+    """
+    executor = _get_executor()
+    if not _pending.acquire(blocking=False):
+        raise Throttled(detail='Too many login attempts in progress, try again later.')
+    try:
+        return await asyncio.wrap_future(executor.submit(func, *args))
+    finally:
+        _pending.release()
+
+
+async def averify_password(user, password: str) -> bool:
+    """ Checks the password like `user.check_password`, with hashing offloaded to the pool
+
+    On success a hash made by another hasher or with another iteration count is replaced
+    by one from the preferred hasher (PASSWORD_HASHERS[0]).
+    """
+    encoded = user.password
+    # no setter: the pool threads must not touch the database
+    if not await arun_hashing(check_password, password, encoded):
+        return False
+
+    preferred = get_hasher('default')
+    hasher = identify_hasher(encoded)
+    if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+        user.password = await arun_hashing(make_password, password)
+        await user.asave(update_fields=['password'])
+    return True
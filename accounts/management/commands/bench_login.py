@@ -0,0 +1,52 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.core.management.base import BaseCommand
+from rest_framework.exceptions import Throttled
+
+from accounts.hashers import TunedPBKDF2PasswordHasher, run_hashing
+
+
+class Command(BaseCommand):
+    help = 'Measures login password verification throughput through the hashing pool (logins/sec per core)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='number of simulated logins')
+        parser.add_argument('--concurrency', type=int, default=settings.PASSWORD_HASH_WORKERS * 2, help='concurrent login requests')
+        parser.add_argument('--iterations', type=int, default=settings.PASSWORD_HASH_ITERATIONS, help='PBKDF2 iterations of the stored hash')
+
+    def handle(self, *args, **options):
+        hasher = TunedPBKDF2PasswordHasher()
+        encoded = hasher.encode('benchmark-password', hasher.salt(), iterations=options['iterations'])
+        latencies = []
+        shed = 0
+
+        def login():
+            nonlocal shed
+            started = time.perf_counter()
+            try:
+                run_hashing(check_password, 'benchmark-password', encoded)
+            except Throttled:
+                shed += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as clients:
+            for _ in range(options['count']):
+                clients.submit(login)
+        elapsed = time.perf_counter() - started
+
+        cores = min(settings.PASSWORD_HASH_WORKERS, os.cpu_count() or 1)
+        latencies.sort()
+        rate = len(latencies) / elapsed
+        self.stdout.write(f'iterations: {options["iterations"]}, workers: {settings.PASSWORD_HASH_WORKERS}, cores used: {cores}')
+        self.stdout.write(f'logins: {len(latencies)} ok, {shed} shed (429) in {elapsed:.2f}s')
+        self.stdout.write(f'throughput: {rate:.1f} logins/sec, {rate / cores:.1f} logins/sec per core')
+        if latencies:
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            self.stdout.write(f'latency: p50 {p50:.1f}ms, p99 {p99:.1f}ms')
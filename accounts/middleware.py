@@ -1,23 +1,31 @@
+from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .authentication import CachedJWTAuthentication, token_cache
 
 # jwt middleware
 class JWTAuthMiddleware:
     def __init__(self, inner):
         self.inner = inner
+        self.authentication = CachedJWTAuthentication()
 
     async def __call__(self, scope, receive, send):
-        headers = dict(scope['headers'])
-        if b'authorization' in headers:
-            try:
-                token_name, token_key = headers[b'authorization'].decode().split()
-                if token_name.lower() == 'bearer':
-                    authentication = JWTAuthentication()
-                    validated_token = authentication.get_validated_token(token_key)
-                    user = authentication.get_user(validated_token)
-                    scope['user'] = user
-            except Exception as e:
-                scope['user'] = AnonymousUser()
-        else:
-            scope['user'] = AnonymousUser()
-        return await self.inner(scope, receive, send)
\ No newline at end of file
+        scope['user'] = await self.get_user(dict(scope['headers']))
+        return await self.inner(scope, receive, send)
+
+    async def get_user(self, headers: dict):
+        if b'authorization' not in headers:
+            return AnonymousUser()
+        try:
+            token_name, token_key = headers[b'authorization'].split()
+            if token_name.lower() != b'bearer':
+                return AnonymousUser()
+
+            cached = token_cache.get(token_key)
+            if cached is not None:
+                return cached[0]
+            # the user lookup is a DB query, run it in a thread instead of on the event loop
+            user, _ = await database_sync_to_async(self.authentication.authenticate_token)(token_key)
+            return user
+        except Exception as e:
+            return AnonymousUser()
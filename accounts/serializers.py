@@ -31,15 +31,12 @@ class LoginUserSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         email = data.get('email')
-        password = data.get('password')
         try:
             user = User.objects.get(email=email)
         except User.DoesNotExist:
             raise serializers.ValidationError("Email is not registered.")
         
-        if not user.check_password(password):
-            raise serializers.ValidationError("Wrong password.")
-        
+        # the password is checked by LoginUserView, which awaits the hashing pool
         data['user'] = user
         return data
         
@@ -0,0 +1,26 @@
+from celery_app import app
+from django.conf import settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+# periodic (celery beat) cleanup of expired refresh tokens, replaces the per-login purge
+@app.task()
+def flush_expired_tokens(batch_size: int = None) -> int:
+    """ Deletes expired OutstandingToken rows (and their blacklist entries) in batches
+
+    Every batch is one set-based DELETE per table, so a large backlog never holds long locks.
+
+    Returns:
+        Number of deleted tokens
+    """
+    batch_size = batch_size or settings.TOKEN_FLUSH_BATCH_SIZE
+    now = aware_utcnow()
+    deleted = 0
+    while True:
+        ids = list(OutstandingToken.objects.filter(expires_at__lte=now).order_by().values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # only('id'): the cascade to blacklist entries needs ids, not the stored token strings
+        OutstandingToken.objects.filter(id__in=ids).only('id').delete()
+        deleted += len(ids)
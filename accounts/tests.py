@@ -1,7 +1,23 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
+import asyncio
+import threading
 from unittest.mock import patch
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import CachedJWTAuthentication, TokenUserCache, token_cache
+from .middleware import JWTAuthMiddleware
+from .tasks import flush_expired_tokens
+from . import hashers
+from datetime import timedelta
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
 from .serializers import CreateUserSerializer
 from .models import User
 
@@ -53,7 +69,122 @@ class LoginUserViewTest(APITestCase):
         self.assertEqual(response.data['status'], 'success')
         self.assertEqual(response.data['user']['id'], self.user.id)
 
+    def test_login_cost_does_not_grow_with_token_history(self):
+        for _ in range(20):
+            RefreshToken.for_user(self.user)
+        with self.assertNumQueries(2):  # user lookup + token insert
+            response = self.client.post(self.url, self.valid_login_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(OutstandingToken.objects.filter(user=self.user).count(), 21)
+
+    @override_settings(PASSWORD_HASHERS=['accounts.hashers.TunedPBKDF2PasswordHasher', 'django.contrib.auth.hashers.PBKDF2PasswordHasher'])
+    def test_login_upgrades_outdated_hash(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=1000):
+            user = User.objects.create_user(email='old@gmail.com', username='old', password='oldpassword123')
+        self.assertIn('$1000$', user.password)
+        response = self.client.post(self.url, {'email': 'old@gmail.com', 'password': 'oldpassword123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        user.refresh_from_db()
+        self.assertIn(f'${settings.PASSWORD_HASH_ITERATIONS}$', user.password)
+        self.assertTrue(user.check_password('oldpassword123'))
+
+    def test_login_is_shed_when_hash_pool_is_full(self):
+        hashers._get_executor()
+        with patch.object(hashers, '_pending', threading.BoundedSemaphore(1)) as pending:
+            pending.acquire()
+            response = self.client.post(self.url, self.valid_login_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    async def test_waiting_logins_hold_no_thread(self):
+        # two logins wait for their hashes together, the next one is shed
+        gate = threading.Event()
+        check_password = hashers.check_password
+        slow_check = lambda *args: gate.wait(5) and check_password(*args)
+        hashers._get_executor()
+        with patch.object(hashers, '_pending', threading.BoundedSemaphore(2)) as pending, patch.object(hashers, 'check_password', slow_check):
+            waiting = [asyncio.create_task(self.async_client.post(self.url, self.valid_login_data, content_type='application/json')) for _ in range(2)]
+            for _ in range(500):
+                if pending._value == 0:
+                    break
+                await asyncio.sleep(0.01)
+            shed = await self.async_client.post(self.url, self.valid_login_data, content_type='application/json')
+            gate.set()
+            responses = await asyncio.gather(*waiting)
+        self.assertEqual(shed.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_202_ACCEPTED] * 2)
+
     def test_login_user_invalid_credentials(self):
         response = self.client.post(self.url, self.invalid_login_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertEqual(response.data['status'], 'error')
\ No newline at end of file
+        self.assertEqual(response.data['status'], 'error')
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(email='test@gmail.com', username='test', password='testpassword123')
+        self.token = str(AccessToken.for_user(self.user))
+        self.request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_repeated_token_skips_user_query(self):
+        with self.assertNumQueries(1):
+            user, _ = CachedJWTAuthentication().authenticate(self.request)
+        with self.assertNumQueries(0):
+            cached_user, _ = CachedJWTAuthentication().authenticate(self.request)
+        self.assertEqual(user, self.user)
+        self.assertEqual(cached_user, self.user)
+
+    def test_deactivated_user_is_rejected(self):
+        CachedJWTAuthentication().authenticate(self.request)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            CachedJWTAuthentication().authenticate(self.request)
+
+    def test_forget_user_drops_only_their_tokens(self):
+        other = User.objects.create_user(email='other@gmail.com', username='other', password='testpassword123')
+        tokens = [AccessToken.for_user(user) for user in (self.user, self.user, other)]
+        for token in tokens:
+            token_cache.set(str(token).encode(), User.objects.get(id=token['user_id']), token)
+        token_cache.forget_user(self.user.id)
+        self.assertEqual([token_cache.get(str(token).encode()) is not None for token in tokens], [False, False, True])
+
+        # evicted entries leave the index too
+        small_cache = TokenUserCache(ttl=60, max_size=1)
+        small_cache.set(str(tokens[0]).encode(), self.user, tokens[0])
+        small_cache.set(str(tokens[2]).encode(), other, tokens[2])
+        self.assertEqual(small_cache._tokens_by_user, {other.pk: {str(tokens[2]).encode()}})
+
+    def test_entry_never_outlives_token(self):
+        token = AccessToken.for_user(self.user)
+        token.set_exp(lifetime=-token.lifetime)
+        token_cache.set(str(token).encode(), self.user, token)
+        self.assertIsNone(token_cache.get(str(token).encode()))
+
+    async def test_websocket_middleware(self):
+        middleware = JWTAuthMiddleware(None)
+        user = await middleware.get_user({b'authorization': f'Bearer {self.token}'.encode()})
+        self.assertEqual(user, self.user)
+        user = await middleware.get_user({b'authorization': b'Bearer not-a-token'})
+        self.assertIsInstance(user, AnonymousUser)
+        self.assertIsInstance(await middleware.get_user({}), AnonymousUser)
+
+
+class FlushExpiredTokensTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='test@gmail.com', username='test', password='testpassword123')
+        self.active = RefreshToken.for_user(self.user)
+        for _ in range(5):
+            RefreshToken.for_user(self.user)
+        OutstandingToken.objects.exclude(jti=self.active['jti']).update(expires_at=aware_utcnow() - timedelta(minutes=1))
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.exclude(jti=self.active['jti']).first())
+
+    def test_only_expired_tokens_are_deleted(self):
+        self.assertEqual(flush_expired_tokens(), 5)
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [self.active['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+    def test_one_delete_per_batch(self):
+        # 3 batches: select expired ids + collect ids + delete blacklist entries + delete tokens, then the empty select
+        with self.assertNumQueries(3 * 4 + 1):
+            flush_expired_tokens(batch_size=2)
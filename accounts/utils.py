@@ -1,4 +1,3 @@
-from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from .models import User
@@ -13,16 +12,6 @@ def error_detail(e):
     
     return error_messages
 
-def check_expired_tokens(user: User) -> bool:
-    """
-    Checks if user`s token is expired (for deleting expired tokens)
-    """
-    tokens = OutstandingToken.objects.filter(user_id=user.id)
-    if tokens:
-        [token.delete() for token in tokens]
-        
-    return True
-    
 def get_user_jwt(user: User):
     """ Creating JWT tokens for User 
     
@@ -35,8 +24,7 @@ def get_user_jwt(user: User):
     Returns:
         Function returns two JWT tokens (access & refresh)
     """
-    # checking if there are expired tokens (to delete them)
-    check_expired_tokens(user)
+    # expired tokens are deleted periodically (accounts.tasks.flush_expired_tokens), not on login
     refresh = RefreshToken.for_user(user)
 
     return {
@@ -1,12 +1,17 @@
+import inspect
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
 from rest_framework import generics, serializers, status, mixins
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.settings import api_settings
+from .authentication import CachedJWTAuthentication
 
 from .serializers import CreateUserSerializer, LoginUserSerializer, UserSerializer
 from .models import User
-from .utils import get_user_jwt, error_detail, check_expired_tokens
+from .hashers import averify_password
+from .utils import get_user_jwt, error_detail
 
 # registration view
 class CreateUserView(generics.CreateAPIView):
@@ -35,35 +40,58 @@ class CreateUserView(generics.CreateAPIView):
             return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
         
 
-# login view 
+# login view: async, so a login waiting for its password hash holds no request thread
+# (the hashing pool bounds the work, PASSWORD_HASH_MAX_PENDING the waiting logins)
 class LoginUserView(generics.GenericAPIView):
     queryset = User.objects.all()
     serializer_class = LoginUserSerializer
-    
-    def post(self, request):
+
+    async def dispatch(self, request, *args, **kwargs):
+        # APIView.dispatch with the sync hooks (authentication, throttles) run in a thread
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def post(self, request):
         serializer = self.get_serializer(data=request.data)
-        if serializer.is_valid():
+        if await sync_to_async(serializer.is_valid)():
             user = serializer.validated_data.get('user')
-            check_expired_tokens(user)
-            jwt_tokens = get_user_jwt(user)
-            return Response({
-                'status': 'success',
-                'detail': "Logged in successfully!",
-                'user': {
-                        'id': user.id,
-                        'tokens': jwt_tokens
-                        }
-            }, status=status.HTTP_202_ACCEPTED)
+            # hashing runs in the bounded pool (429 when it's saturated), outdated hashes are upgraded
+            if await averify_password(user, serializer.validated_data.get('password')):
+                jwt_tokens = await sync_to_async(get_user_jwt)(user)
+                return Response({
+                    'status': 'success',
+                    'detail': "Logged in successfully!",
+                    'user': {
+                            'id': user.id,
+                            'tokens': jwt_tokens
+                            }
+                }, status=status.HTTP_202_ACCEPTED)
+            errors = {api_settings.NON_FIELD_ERRORS_KEY: ["Wrong password."]}
+        else:
+            errors = serializer.errors
         return Response({
             'status': 'error',
-            'detail': serializer.errors
+            'detail': errors
         }, status=status.HTTP_400_BAD_REQUEST)
             
             
 class UserView(generics.RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    authentication_classes = (JWTAuthentication, )
+    authentication_classes = (CachedJWTAuthentication, )
     permission_classes = (IsAuthenticated, )
     
     def get(self, request, *args, **kwargs):
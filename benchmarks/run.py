@@ -0,0 +1,261 @@
+"""
+Benchmark suite for the REST, websocket and Celery paths
+
+    python -m benchmarks.run [--only create_post list_posts ...] [--scale 1.0] [--output results.json]
+
+Runs against the stand-ins of benchmarks.settings and prints (or writes) JSON results,
+tagged with the current commit, for comparison across commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+
+import django  # noqa: E402
+
+django.setup()
+
+from asgiref.sync import async_to_sync  # noqa: E402
+from asgiref.testing import ApplicationCommunicator  # noqa: E402
+from channels.layers import get_channel_layer  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from accounts.models import User  # noqa: E402
+from posts import utils  # noqa: E402
+from posts.broadcast import dumps, encode_frame  # noqa: E402
+from posts.consumers import PostConsumer  # noqa: E402
+from posts.models import Post  # noqa: E402
+from posts.page_cache import bump_generation  # noqa: E402
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    return {
+        'count': len(latencies),
+        'seconds': round(elapsed, 4),
+        'ops_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def measure(func, count: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        call_started = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def ameasure(func, count: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        call_started = time.perf_counter()
+        await func(i)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def seed_posts(user: User, count: int):
+    Post.objects.all().delete()
+    Post.objects.bulk_create([Post(owner=user, text=f'Seeded post {i}') for i in range(count)], batch_size=5000)
+    bump_generation('posts')
+
+
+def websocket_scope() -> dict:
+    return {'type': 'websocket', 'path': '/ws/posts/', 'headers': [], 'query_string': b'', 'subprotocols': []}
+
+
+# benchmarks: each takes (user, scale) and returns a JSON-serializable dict
+
+def bench_create_post(user: User, scale: float) -> dict:
+    """ POST /create via the blocking celery path and the async (202) path """
+    client = APIClient()
+    client.force_authenticate(user=user)
+    url = reverse('create-post')
+    count = max(1, int(200 * scale))
+    results = {}
+    for mode, async_create in (('sync', False), ('async', True)):
+        with override_settings(ASYNC_CREATE=async_create):
+            results[mode] = measure(lambda i: client.post(url, {'text': f'Benchmark post {mode} {i}'}, format='json'), count)
+    return results
+
+
+def bench_list_posts(user: User, scale: float) -> dict:
+    """ GET /posts at increasing page depth, page number vs keyset, cold (cache bumped) vs cached """
+    total = max(100, int(20000 * scale))
+    seed_posts(user, total)
+    client = APIClient()
+    url = reverse('post-list')
+    count = max(1, int(50 * scale))
+    last_page = total // 25
+    results = {'rows': total}
+    for depth in sorted({1, max(1, last_page // 2), last_page}):
+        def cold_page(i, depth=depth):
+            bump_generation('posts')
+            client.get(url, {'page': depth})
+        results[f'page_{depth}_cold'] = measure(cold_page, count)
+        results[f'page_{depth}_cached'] = measure(lambda i, depth=depth: client.get(url, {'page': depth}), count)
+
+    # keyset: walk cursors to the middle, then measure that page
+    response = client.get(url, {'cursor': ''})
+    for _ in range(last_page // 2):
+        if not response.data['next_cursor']:
+            break
+        response = client.get(url, {'cursor': response.data['next_cursor']})
+    cursor = response.data['next_cursor'] or ''
+
+    def cold_cursor(i):
+        bump_generation('posts')
+        client.get(url, {'cursor': cursor})
+    results['keyset_middle_cold'] = measure(cold_cursor, count)
+    return results
+
+
+def bench_consumer_get_posts(user: User, scale: float) -> dict:
+    """ PostConsumer.get_posts action round trip (page number and cursor modes) """
+    seed_posts(user, max(100, int(5000 * scale)))
+    count = max(1, int(200 * scale))
+
+    async def run():
+        communicator = ApplicationCommunicator(PostConsumer.as_asgi(), websocket_scope())
+        await communicator.send_input({'type': 'websocket.connect'})
+        await communicator.receive_output()
+        results = {}
+        for mode, payload in (('page', {'page_num': 3}), ('cursor', {})):
+            async def action(i, payload=payload):
+                bump_generation('posts')
+                await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'action': 'get_posts', 'request_id': i, **payload})})
+                await communicator.receive_output(timeout=10)
+            results[mode] = await ameasure(action, count)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+        return results
+
+    return async_to_sync(run)()
+
+
+def bench_fanout(user: User, scale: float) -> dict:
+    """ One broadcast to N connected feed sockets: time until every socket got the frame """
+    results = {}
+    for sockets in sorted({10, max(10, int(100 * scale)), max(10, int(1000 * scale))}):
+        async def run(sockets=sockets):
+            communicators = []
+            for _ in range(sockets):
+                communicator = ApplicationCommunicator(PostConsumer.as_asgi(), websocket_scope())
+                await communicator.send_input({'type': 'websocket.connect'})
+                await communicator.receive_output()
+                communicators.append(communicator)
+
+            frame = encode_frame('display_post', 'post', dumps({'id': 1, 'username': 'user', 'text': 'Benchmark'}))
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(10):
+                sent = time.perf_counter()
+                await get_channel_layer().group_send('posts_group', {'type': 'add_post', 'text': frame})
+                await asyncio.gather(*(communicator.receive_output(timeout=10) for communicator in communicators))
+                latencies.append(time.perf_counter() - sent)
+            elapsed = time.perf_counter() - started
+
+            for communicator in communicators:
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await communicator.wait()
+            result = summarize(latencies, elapsed)
+            result['frames_per_sec'] = round(sockets * len(latencies) / elapsed, 1)
+            return result
+
+        results[f'{sockets}_sockets'] = async_to_sync(run)()
+    return results
+
+
+def bench_classifier(user: User, scale: float) -> dict:
+    """ check_for_obscence one by one vs check_many_for_obscence batches (stub pipeline, cold verdict cache) """
+    count = max(10, int(2000 * scale))
+    results = {}
+    for mode in ('single', 'batch'):
+        utils.verdict_cache.clear()
+        texts = [f'{mode} benchmark text {i} {time.time_ns()}' for i in range(count)]
+        started = time.perf_counter()
+        if mode == 'single':
+            for text in texts:
+                utils.check_for_obscence(text)
+        else:
+            for i in range(0, count, 256):
+                utils.check_many_for_obscence(texts[i:i + 256])
+        elapsed = time.perf_counter() - started
+        results[mode] = {'texts': count, 'seconds': round(elapsed, 4), 'texts_per_sec': round(count / elapsed, 1)}
+    return results
+
+
+BENCHMARKS = {
+    'create_post': bench_create_post,
+    'list_posts': bench_list_posts,
+    'consumer_get_posts': bench_consumer_get_posts,
+    'fanout': bench_fanout,
+    'classifier': bench_classifier,
+}
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='run only these benchmarks')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies data sizes and iteration counts')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0)
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'email': 'benchmark@example.com'})
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f'running {name}...', file=sys.stderr)
+        results[name] = BENCHMARKS[name](user, args.scale)
+
+    report = {
+        'commit': current_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+        'scale': args.scale,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        os.remove(settings.DATABASES['default']['NAME'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Settings for the benchmark suite (python -m benchmarks.run)
+
+Local stand-ins for every external service: SQLite file (or a local PostgreSQL with
+BENCH_DATABASE=postgres), in-memory channel layers, eager Celery, local memory cache
+and a stub classifier, so results only depend on this code and the machine.
+"""
+import os
+import tempfile
+
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from config.settings import *  # noqa: E402,F401,F403
+from config.settings import config  # noqa: E402
+
+DEBUG = False
+ALLOWED_HOSTS = ['testserver']
+
+if config('BENCH_DATABASE', default='sqlite') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('BENCH_DB_NAME', default='benchmarks'),
+            'USER': config('BENCH_DB_USER', default='myuser'),
+            'PASSWORD': config('BENCH_DB_PASSWORD', default='mypassword'),
+            'HOST': config('BENCH_DB_HOST', default='localhost'),
+            'PORT': config('BENCH_DB_PORT', default=5432, cast=int),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tempfile.gettempdir(), f'posts-benchmarks-{os.getpid()}.sqlite3'),
+        }
+    }
+
+CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10000}},
+}
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+CELERY_ALWAYS_EAGER = True
+CELERY_BROKER_URL = 'memory://'
+CELERY_RESULT_BACKEND = 'cache+memory://'
+
+MODERATION_PIPELINE = 'benchmarks.stubs.stub_pipeline'
+# benchmark users are created in bulk, the hashing cost is measured by bench_login instead
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
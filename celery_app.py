@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_init
 from django.conf import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", 'config.settings')
@@ -9,3 +10,15 @@ app.config_from_object('django.conf:settings')
 app.conf.broker_url = settings.CELERY_BROKER_URL
 app.autodiscover_tasks()
 
+# per-task stage timings (queue wait, classify, db, broadcast) for task_latency_report (TASK_METRICS_FILE)
+if settings.INSTRUMENTATION:
+    from config.task_metrics import connect_signals
+    connect_signals()
+
+
+# load the toxicity model once in the worker parent, so prefork children share it copy-on-write
+@worker_init.connect
+def preload_moderation_model(**kwargs):
+    if settings.MODERATION_PRELOAD_MODEL:
+        from posts.utils import get_pipeline
+        get_pipeline()
@@ -1,56 +1,72 @@
 import json
 from djangochannelsrestframework.generics import GenericAsyncAPIConsumer
 from djangochannelsrestframework.observer.generics import (ObserverModelInstanceMixin, action)
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from accounts.authentication import CachedJWTAuthentication
+from posts.backpressure import BackpressureMixin
+from posts.broadcast import BroadcastGroupsMixin
 
 from .models import Comment
 from .serializers import CommentSerializer
-from .tasks import get_comments
+from posts.page_cache import aget_or_build
+from .queries import aget_comments_page, aget_comments_after, approved_comments
 
 
-class CommentsConsumer(ObserverModelInstanceMixin, GenericAsyncAPIConsumer):
+class CommentsConsumer(BackpressureMixin, BroadcastGroupsMixin, ObserverModelInstanceMixin, GenericAsyncAPIConsumer):
     
     serializer_class = CommentSerializer
-    authentication_classes = (JWTAuthentication, )
+    authentication_classes = (CachedJWTAuthentication, )
+    # instances clients can subscribe to (subscribe_instance)
+    queryset = approved_comments()
     
     #default action to connect websocket
     async def connect(self):
         self.post_id = self.scope['url_route']['kwargs']['post_id']
         self.room_group_name = f'post_{self.post_id}'
         # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        await self.broadcast_group_add(self.room_group_name)
 
         await self.accept()
 
         
     
-    # action for load comments
+    # action for load comments (pass `cursor` instead of `page_num` for keyset pagination)
     @action()
-    async def get_comments(self, page_num: int, **kwargs):
-        comments = get_comments.apply_async(args=[page_num, self.post_id]) # celery task to load data from db
+    async def get_comments(self, page_num: int = None, cursor: str = None, **kwargs):
+        if page_num is None:
+            comments, next_cursor = await aget_or_build(
+                [self.room_group_name], 'comments_after', str(cursor), lambda: aget_comments_after(self.post_id, cursor)
+            )
+            return await self.send(text_data=json.dumps({
+                'event_type': 'display_comment',
+                'comment': comments,
+                'next_cursor': next_cursor
+            }))
+        
+        # async orm query (doesn't block the event loop), cached until the next comment write on this post
+        comments = await aget_or_build(
+            [self.room_group_name], 'comments_page', str(page_num), lambda: aget_comments_page(page_num, self.post_id)
+        )
 
         return await self.send(text_data=json.dumps({
             'event_type': 'display_comment',
-            'comment': comments.get()
+            'comment': comments
         }))
         
-    # create comment function (not @action because of api endpoint)
+    # create comment function (not @action because of api endpoint), the frame comes pre-encoded (posts.broadcast)
     async def add_comment(self, event: dict):
-        comment = event['comment']
-        await self.send(text_data=json.dumps({
-            'event_type': 'display_comment',
-            'comment': comment
-        }))
+        await self.enqueue(event['text'])
+    
+    # new comments coalesced by the broadcaster (BROADCAST_COALESCE_MS), oldest first
+    async def add_comment_batch(self, event: dict):
+        await self.enqueue(event['text'])
+    
+    # moderation verdict for a comment created in async mode
+    async def comment_verdict(self, event: dict):
+        await self.enqueue(event['text'])
     
     # action for close websocket connection
     @action()
     async def logout(self, **kwargs):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        await self.broadcast_group_discard(self.room_group_name)
         await self.close(1000)
     
\ No newline at end of file
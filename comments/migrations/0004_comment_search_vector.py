@@ -0,0 +1,43 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:22
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+# PostgreSQL only: GIN index on the tsvector, trigram index on text and a trigger keeping search_vector up to date
+def create_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX comment_search_idx ON comments_comment USING GIN (search_vector)')
+    schema_editor.execute('CREATE INDEX comment_text_trgm_idx ON comments_comment USING GIN (text gin_trgm_ops)')
+    schema_editor.execute(
+        'CREATE TRIGGER comment_search_vector_update BEFORE INSERT OR UPDATE OF text, search_vector ON comments_comment '
+        "FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.%s', text)" % settings.SEARCH_CONFIG
+    )
+    schema_editor.execute('UPDATE comments_comment SET search_vector = to_tsvector(%s::regconfig, text)', [settings.SEARCH_CONFIG])
+
+
+def drop_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP TRIGGER IF EXISTS comment_search_vector_update ON comments_comment')
+    schema_editor.execute('DROP INDEX IF EXISTS comment_text_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS comment_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0003_comment_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_objects, drop_search_objects),
+    ]
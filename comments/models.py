@@ -1,13 +1,29 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 from accounts.models import User
-from posts.models import Post
+from posts.models import Post, ModerationStatus
 
 class Comment(models.Model):
     owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     text = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # a default rather than auto_now_add, so imported rows (posts.bulk) keep their own timestamps
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    status = models.CharField(max_length=16, choices=ModerationStatus.choices, default=ModerationStatus.APPROVED)
+    # maintained by a database trigger on PostgreSQL (see posts.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    
+    class Meta:
+        indexes = [
+            # comments of one post (websocket feed, ?post= filter)
+            models.Index(fields=['post', 'status', 'created_at', 'id'], name='comment_post_feed_idx'),
+            # list & date range queries over all posts
+            models.Index(fields=['status', 'created_at', 'id'], name='comment_feed_idx'),
+            # ?owner= filter
+            models.Index(fields=['owner', 'status', 'created_at'], name='comment_owner_feed_idx'),
+        ]
     
     def __str__(self):
         return f'{self.post} - {self.owner} - {self.id}'
\ No newline at end of file
@@ -0,0 +1,44 @@
+from posts.models import ModerationStatus
+from posts.pagination import keyset_page, akeyset_page
+from posts.queries import PAGE_SIZE, page_bounds
+from .models import Comment
+
+
+# shared base queryset for comment read paths (owner is joined for usernames)
+def approved_comments():
+    return Comment.objects.filter(status=ModerationStatus.APPROVED).select_related('owner').defer('search_vector')
+
+
+# approved comments of the post, newest first
+def post_comments_queryset(post_id: int):
+    return approved_comments().filter(post_id=post_id).order_by('-created_at', '-id')
+
+
+def serialize_feed_comment(comment: Comment) -> dict:
+    return {
+        'id': comment.id,
+        'username': comment.owner.username if comment.owner else None,
+        'text': comment.text
+    }
+
+
+def get_comments_page(page_num: int, post_id: int) -> list:
+    start, end = page_bounds(page_num)
+    return [serialize_feed_comment(comment) for comment in post_comments_queryset(post_id)[start:end]]
+
+
+# same as get_comments_page, but doesn't block the event loop (used by websocket consumers)
+async def aget_comments_page(page_num: int, post_id: int) -> list:
+    start, end = page_bounds(page_num)
+    return [serialize_feed_comment(comment) async for comment in post_comments_queryset(post_id)[start:end]]
+
+
+# keyset pagination: the cursor of the last seen comment replaces page_num
+def get_comments_after(post_id: int, cursor: str = None) -> tuple:
+    comments, next_cursor = keyset_page(post_comments_queryset(post_id), cursor, PAGE_SIZE)
+    return [serialize_feed_comment(comment) for comment in comments], next_cursor
+
+
+async def aget_comments_after(post_id: int, cursor: str = None) -> tuple:
+    comments, next_cursor = await akeyset_page(post_comments_queryset(post_id), cursor, PAGE_SIZE)
+    return [serialize_feed_comment(comment) for comment in comments], next_cursor
@@ -9,6 +9,12 @@ class CreateCommentSerializer(serializers.ModelSerializer):
         
         
         
+class CommentStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Comment
+        fields = ['id', 'status']
+        
+        
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
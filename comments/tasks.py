@@ -1,26 +1,24 @@
 from celery_app import app
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync, sync_to_async
-from django.core.paginator import Paginator
+from asgiref.sync import sync_to_async
 from django.http import Http404
 from django.db import transaction
 from rest_framework import status
 from rest_framework.response import Response
-from django.core.cache import cache
 
 from accounts.models import User
-from posts.models import Post
+from posts.models import Post, ModerationStatus
 from .models import Comment
 from .serializers import CommentSerializer
+from .queries import get_comments_page, serialize_feed_comment
 from posts.utils import check_for_obscence
+from posts.page_cache import get_or_build, bump_generation_on_commit
+from posts.counters import comment_added
+from posts.broadcast import broadcast_event, broadcast_frame
 
-# cache clear function
-def clear_comments_cache():
-    cache_keys_to_clear = [
-        f'comments_page_{page_num}'
-        for page_num in range(1, 100)
-    ]
-    cache.delete_many(cache_keys_to_clear)
+
+# notify websocket users about new comment (same item shape as comment pages, encoded once for every socket)
+def broadcast_comment(comment: Comment):
+    broadcast_event(f"post_{comment.post_id}", 'add_comment', 'display_comment', 'comment', serialize_feed_comment(comment))
 
 
 # celery task for creating comment & notify websocket users
@@ -34,34 +32,46 @@ def create_comment(owner_id: int, comment_data: dict, *args):
         post_id = comment_data.pop('post')
         post = Post.objects.get(id=post_id) 
         comment = Comment.objects.create(owner=user, post=post, **comment_data)
+        comment_added(post.id, comment.created_at)
         comment_data = CommentSerializer(comment).data
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-                    f"post_{post.id}",
-                    {
-                        'type': 'add_comment',
-                        'comment': {
-                            'username': comment.owner.username,
-                            'text': comment.text,
-                        }
-                    }
-                )
+        broadcast_comment(comment)
         return {'status':'success', 'detail': 'Comment created successfully!', 'comment': comment_data}
     else:
         return {'status': 'fail', 'detail': 'Your comment is obscene. The comment will not be created.'}
 
-# celery task to load comments
+
+# celery task to moderate a comment stored in "pending" state (async creation mode)
 @app.task()
-def get_comments(page_num: int, post_id: int) -> list:
-    queryset = Comment.objects.filter(post_id=post_id).order_by('created_at')[::-1]
-    paginator = Paginator(queryset, 25)
-    result = paginator.get_page(page_num)
-    comments = []
-    for comment in result:
-        comments.append({
+def moderate_comment(comment_id: int):
+    comment = Comment.objects.select_related('owner').filter(id=comment_id, status=ModerationStatus.PENDING).first()
+    if comment is None:
+        return {'status': 'fail', 'detail': 'Comment is not pending moderation.'}
+
+    comment.status = ModerationStatus.APPROVED if check_for_obscence(comment.text) else ModerationStatus.REJECTED
+    with transaction.atomic():
+        # conditional update: a redelivered or duplicate task finds the comment already moderated
+        # and must not count it again (update() skips post_save, so pages are bumped here)
+        moderated = Comment.objects.filter(id=comment.id, status=ModerationStatus.PENDING).update(status=comment.status)
+        if moderated:
+            bump_generation_on_commit('comments', f'post_{comment.post_id}')
+            if comment.status == ModerationStatus.APPROVED:
+                comment_added(comment.post_id, comment.created_at)
+    if not moderated:
+        return {'status': 'fail', 'detail': 'Comment is not pending moderation.'}
+
+    if comment.status == ModerationStatus.APPROVED:
+        broadcast_comment(comment)
+    broadcast_frame(f"post_{comment.post_id}", 'comment_verdict', {
+        'event_type': 'comment_verdict',
+        'verdict': {
             'id': comment.id,
-            'username': comment.owner.username,
-            'text': comment.text
-        })
-        
-    return comments
+            'owner': comment.owner_id,
+            'status': comment.status,
+        }
+    })
+    return {'status': comment.status, 'comment_id': comment.id}
+
+# celery task to load comments (cached until the next comment write on the post)
+@app.task()
+def get_comments(page_num: int, post_id: int) -> list:
+    return get_or_build([f'post_{post_id}'], 'comments_page', str(page_num), lambda: get_comments_page(page_num, post_id))
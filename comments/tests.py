@@ -2,11 +2,28 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from rest_framework_simplejwt.tokens import RefreshToken
-from unittest.mock import patch
+from channels.routing import URLRouter
+import io
+import json
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from unittest.mock import AsyncMock, patch
+from celery_app import app
 
 from accounts.models import User
-from posts.models import Post
+from posts.models import Post, ModerationStatus
+from posts.tests import websocket_scope, QueryPlanAssertions
+from posts.pagination import keyset_queryset, encode_cursor
+from posts.search import get_inverted_index
+from posts.counters import comment_added, reconcile_comment_counters
 from .models import Comment
+from .tasks import create_comment, moderate_comment, get_comments
+from .routing import websocket_urlpatterns
+from .queries import post_comments_queryset, get_comments_page
+from .filters import CommentFilter
+from .views import ListCommentView
 from .serializers import CreateCommentSerializer
 
 class CreateCommentViewTests(APITestCase):
@@ -50,6 +67,88 @@ class CreateCommentViewTests(APITestCase):
         response = self.client.post(self.url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         
+class IdempotentCreateCommentTests(APITestCase):
+    def setUp(self):
+        # the create tasks run in-process, whatever the test settings say
+        self.addCleanup(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.post = Post.objects.create(owner=self.user, text='Some text')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('create-comment')
+
+    @patch('comments.tasks.check_for_obscence', return_value=True)
+    def test_retry_creates_one_comment(self, mock_check_obscence):
+        data = {'text': 'Some normal text', 'owner': self.user.id, 'post': self.post.id}
+        first = self.client.post(self.url, data, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        retry = self.client.post(self.url, data, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual((first.status_code, retry.status_code), (status.HTTP_201_CREATED, status.HTTP_201_CREATED))
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Comment.objects.count(), 1)
+        mock_check_obscence.assert_called_once()
+
+
+@override_settings(ASYNC_CREATE=True)
+class AsyncCreateCommentViewTests(APITestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.post = Post.objects.create(owner=self.user, text='Some text')
+        self.client = APIClient()
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        self.url = reverse('create-comment')
+    
+    @patch('comments.views.moderate_comment.apply_async')
+    def test_create_comment_returns_immediately(self, mock_moderate_comment):
+        mock_moderate_comment.return_value.id = 'task-id'
+        data = {'text': 'Some normal text', 'owner': self.user.id, 'post': self.post.id}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        comment = Comment.objects.get(id=response.data['comment_id'])
+        self.assertEqual(comment.status, ModerationStatus.PENDING)
+        self.assertEqual(response.data['task_id'], 'task-id')
+        mock_moderate_comment.assert_called_once_with(args=[comment.id])
+        mock_moderate_comment.return_value.get.assert_not_called()
+
+
+class ModerateCommentTaskTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.post = Post.objects.create(owner=self.user, text='Some text')
+        self.comment = Comment.objects.create(owner=self.user, post=self.post, text='Some comment', status=ModerationStatus.PENDING)
+        patcher = patch('posts.broadcast.get_channel_layer')
+        self.channel_layer = patcher.start().return_value
+        self.channel_layer.group_send = AsyncMock()
+        self.addCleanup(patcher.stop)
+    
+    @patch('comments.tasks.check_for_obscence', return_value=True)
+    def test_clean_comment_is_approved_and_published(self, mock_check_obscence):
+        moderate_comment(self.comment.id)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.status, ModerationStatus.APPROVED)
+        groups = {call.args[0] for call in self.channel_layer.group_send.call_args_list}
+        event_types = [call.args[1]['type'] for call in self.channel_layer.group_send.call_args_list]
+        self.assertEqual(groups, {f'post_{self.post.id}'})
+        self.assertEqual(event_types, ['add_comment', 'comment_verdict'])
+    
+    @patch('comments.tasks.check_for_obscence', return_value=False)
+    def test_obscene_comment_is_rejected(self, mock_check_obscence):
+        moderate_comment(self.comment.id)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.status, ModerationStatus.REJECTED)
+        self.assertEqual(self.channel_layer.group_send.call_count, 1)
+        self.assertFalse(Comment.objects.filter(status=ModerationStatus.APPROVED).exists())
+    
+    def test_status_endpoint(self):
+        client = APIClient()
+        refresh = RefreshToken.for_user(self.user)
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        response = client.get(reverse('comment-status', kwargs={'id': self.comment.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], ModerationStatus.PENDING)
+        
+        
 class RetrieveCommentViewTests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword')
@@ -79,6 +178,7 @@ class RetrieveCommentViewTests(APITestCase):
         
 class ListCommentViewTests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.client = APIClient()
         refresh = RefreshToken.for_user(self.user)
@@ -110,6 +210,34 @@ class ListCommentViewTests(APITestCase):
         self.assertEqual(response.data.get('results')[0]['text'], self.comment1.text)
         
         
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class CommentsConsumerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.post = Post.objects.create(owner=self.user, text='Some text')
+        self.other_post = Post.objects.create(owner=self.user, text='Other text')
+        self.comment1 = Comment.objects.create(owner=self.user, text='First comment', post=self.post)
+        self.comment2 = Comment.objects.create(owner=self.user, text='Second comment', post=self.post)
+        Comment.objects.create(owner=self.user, text='Other comment', post=self.other_post)
+    
+    @patch('comments.tasks.get_comments.apply_async')
+    async def test_get_comments_reads_db_without_celery(self, mock_get_comments):
+        communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), websocket_scope(f'/ws/posts/{self.post.id}/comments/'))
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'action': 'get_comments', 'request_id': 1, 'page_num': 1})})
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual(response['event_type'], 'display_comment')
+        self.assertEqual([comment['id'] for comment in response['comment']], [self.comment2.id, self.comment1.id])
+        self.assertEqual(response['comment'][0]['username'], 'testuser')
+        
+        mock_get_comments.assert_not_called()
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+        
+        
 class UpdateCommentViewTests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
@@ -178,4 +306,172 @@ class DeleteCommentViewTests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
         response = self.client.delete(self.url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
-        self.assertTrue(Comment.objects.filter(id=self.comment.id).exists())
\ No newline at end of file
+        self.assertTrue(Comment.objects.filter(id=self.comment.id).exists())
+
+
+class CommentQueryPlanTests(QueryPlanAssertions, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.post = Post.objects.create(owner=self.user, text='Some text')
+        self.comment = Comment.objects.create(owner=self.user, text='Some comment', post=self.post)
+
+    def test_websocket_feed(self):
+        self.assertUsesIndex(post_comments_queryset(self.post.id)[:25], 'comment_post_feed_idx')
+
+    def test_websocket_feed_after_cursor(self):
+        queryset = keyset_queryset(post_comments_queryset(self.post.id), encode_cursor(self.comment))
+        self.assertUsesIndex(queryset[:26], 'comment_post_feed_idx')
+
+    def test_list_view(self):
+        self.assertUsesIndex(ListCommentView.queryset.all()[:25], 'comment_feed_idx')
+
+    def test_list_view_post_filter(self):
+        queryset = CommentFilter({'post': self.post.id}, queryset=ListCommentView.queryset.all()).qs
+        self.assertUsesIndex(queryset[:25], 'comment_post_feed_idx')
+
+    def test_list_view_owner_filter(self):
+        queryset = CommentFilter({'owner': self.user.id}, queryset=ListCommentView.queryset.all()).qs
+        self.assertUsesIndex(queryset[:25], 'comment_owner_feed_idx')
+
+
+
+class CommentQueryCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword', email=f'user{i}@gmail.com') for i in range(5)]
+        self.post = Post.objects.create(owner=self.users[0], text='Some text')
+        for i in range(30):
+            Comment.objects.create(owner=self.users[i % 5], text=f'Comment {i}', post=self.post)
+
+    def test_list_view(self):
+        for page_size in (5, 25):
+            with self.assertNumQueries(3):  # ?post= validation + count + page
+                response = self.client.get(reverse('list-comments'), {'page_size': page_size, 'post': self.post.id})
+            self.assertEqual(len(response.data['results']), page_size)
+
+    def test_websocket_feed(self):
+        with self.assertNumQueries(1):
+            comments = get_comments_page(1, self.post.id)
+        self.assertEqual(len(comments), 25)
+        self.assertEqual({comment['username'] for comment in comments}, {user.username for user in self.users})
+
+
+
+class CommentSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        get_inverted_index(Comment).rebuild()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.post = Post.objects.create(owner=self.user, text='Some text')
+        self.other_post = Post.objects.create(owner=self.user, text='Other text')
+        self.comment1 = Comment.objects.create(owner=self.user, text='Great post!', post=self.post)
+        self.comment2 = Comment.objects.create(owner=self.user, text='Not so great', post=self.post)
+        self.comment3 = Comment.objects.create(owner=self.user, text='Great great post', post=self.other_post)
+
+    def test_search_combines_with_filters(self):
+        response = self.client.get(reverse('list-comments'), {'search': 'great', 'post': self.post.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({comment['id'] for comment in response.data['results']}, {self.comment1.id, self.comment2.id})
+
+    def test_search_ranks_matches(self):
+        response = self.client.get(reverse('list-comments'), {'search': 'great post'})
+        self.assertEqual([comment['id'] for comment in response.data['results']], [self.comment3.id, self.comment1.id])
+
+
+class CommentPageCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.post = Post.objects.create(owner=self.user, text='Some text')
+        self.other_post = Post.objects.create(owner=self.user, text='Other text')
+        self.comment = Comment.objects.create(owner=self.user, text='First comment', post=self.post)
+        self.url = reverse('list-comments')
+
+    def test_comment_write_invalidates_only_its_post(self):
+        self.client.get(self.url, {'post': self.post.id})
+        self.client.get(self.url, {'post': self.other_post.id})
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(owner=self.user, text='Second comment', post=self.post)
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {'post': self.other_post.id})
+        response = self.client.get(self.url, {'post': self.post.id})
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_get_comments_task_is_cached(self):
+        self.assertEqual(len(get_comments(1, self.post.id)), 1)
+        with self.assertNumQueries(0):
+            get_comments(1, self.post.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.delete()
+        self.assertEqual(get_comments(1, self.post.id), [])
+
+
+class CommentCounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.post = Post.objects.create(owner=self.user, text='Some text')
+        self.other_post = Post.objects.create(owner=self.user, text='Other text')
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        patcher = patch('posts.broadcast.get_channel_layer')
+        patcher.start().return_value.group_send = AsyncMock()
+        self.addCleanup(patcher.stop)
+
+    def assertCounters(self, post, count, last_comment_at):
+        post.refresh_from_db()
+        self.assertEqual((post.comment_count, post.last_comment_at), (count, last_comment_at))
+
+    @patch('comments.tasks.check_for_obscence', return_value=True)
+    def test_create_comment_task_counts_comment(self, mock_check_obscence):
+        result = create_comment(self.user.id, {'owner': self.user.id, 'post': self.post.id, 'text': 'Some comment'})
+        comment = Comment.objects.get(id=result['comment']['id'])
+        self.assertCounters(self.post, 1, comment.created_at)
+
+    @patch('comments.tasks.check_for_obscence', side_effect=[True, False])
+    def test_only_approved_comments_are_counted(self, mock_check_obscence):
+        approved = Comment.objects.create(owner=self.user, post=self.post, text='Clean', status=ModerationStatus.PENDING)
+        rejected = Comment.objects.create(owner=self.user, post=self.post, text='Obscene', status=ModerationStatus.PENDING)
+        self.assertCounters(self.post, 0, None)
+        moderate_comment(approved.id)
+        moderate_comment(rejected.id)
+        self.assertCounters(self.post, 1, approved.created_at)
+
+    @patch('comments.tasks.check_for_obscence', return_value=True)
+    def test_duplicate_moderation_counts_once(self, mock_check_obscence):
+        comment = Comment.objects.create(owner=self.user, post=self.post, text='Clean', status=ModerationStatus.PENDING)
+        # the redelivered task read the comment while it was still pending
+        with patch('comments.tasks.Comment.objects.select_related') as mock_select_related:
+            mock_select_related.return_value.filter.return_value.first.return_value = Comment.objects.get(id=comment.id)
+            moderate_comment(comment.id)
+            result = moderate_comment(comment.id)
+        self.assertEqual(result['status'], 'fail')
+        self.assertCounters(self.post, 1, comment.created_at)
+
+    def test_delete_comment_uncounts_it(self):
+        first = Comment.objects.create(owner=self.user, post=self.post, text='First')
+        second = Comment.objects.create(owner=self.user, post=self.post, text='Second')
+        comment_added(self.post.id, first.created_at)
+        comment_added(self.post.id, second.created_at)
+        self.assertCounters(self.post, 2, second.created_at)
+
+        response = self.client.delete(reverse('delete-comment', args=[second.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertCounters(self.post, 1, first.created_at)
+
+    def test_moving_comment_moves_its_count(self):
+        comment = Comment.objects.create(owner=self.user, post=self.post, text='Some comment')
+        comment_added(self.post.id, comment.created_at)
+        response = self.client.patch(reverse('update-comment', args=[comment.id]), {'post': self.other_post.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCounters(self.post, 0, None)
+        self.assertCounters(self.other_post, 1, comment.created_at)
+
+    def test_reconcile_command_fixes_drift(self):
+        comment = Comment.objects.create(owner=self.user, post=self.post, text='Some comment')
+        Post.objects.filter(id=self.other_post.id).update(comment_count=3)
+        out = io.StringIO()
+        call_command('reconcile_comment_counters', '--batch-size', '1', stdout=out)
+        self.assertIn('Fixed comment counters of 2 posts.', out.getvalue())
+        self.assertCounters(self.post, 1, comment.created_at)
+        self.assertCounters(self.other_post, 0, None)
+        self.assertEqual(reconcile_comment_counters(), 0)
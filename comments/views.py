@@ -1,67 +1,119 @@
-from rest_framework import generics, status
+from django.conf import settings
+from django.db import transaction
+from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.response import Response
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from accounts.authentication import CachedJWTAuthentication
+from config.metrics import stage
 from django_filters.rest_framework import DjangoFilterBackend
 
-from posts.pagination import ItemPagination
+from posts.pagination import KeysetPagination
+from posts.search import FullTextSearchFilter
 from posts.permissions import IsOwner
+from posts.page_cache import CachedListMixin, bump_generation_on_commit
+from posts.idempotency import IdempotentCreateMixin
+from posts.counters import comment_added, comment_removed
+from posts.models import ModerationStatus
 from .models import Comment
-from .serializers import CreateCommentSerializer, CommentSerializer
+from .serializers import CreateCommentSerializer, CommentSerializer, CommentStatusSerializer
 from .filters import CommentFilter
-from .tasks import create_comment
+from .tasks import create_comment, moderate_comment
+from .queries import approved_comments
 
-class CreateCommentView(generics.CreateAPIView):
+class CreateCommentView(IdempotentCreateMixin, generics.CreateAPIView):
     queryset = Comment.objects.all()
     serializer_class = CreateCommentSerializer
-    authentication_classes = [JWTAuthentication, ]
+    authentication_classes = [CachedJWTAuthentication, ]
     permission_classes = [IsAuthenticated, ]
     
     def perform_create(self, serializer):
+        if settings.ASYNC_CREATE:
+            return self.perform_async_create(serializer)
         comment_data = serializer.validated_data
         serialized_comment_data = CommentSerializer(comment_data).data
         owner_id = self.request.user.id
-        result = create_comment.apply_async(args=[owner_id, serialized_comment_data]).get()
+        task = create_comment.apply_async(args=[owner_id, serialized_comment_data])
+        self.task_started(task)
+        with stage('task_wait'):
+            result = task.get()
        
         return result
     
+    # store the comment as "pending" and let celery moderate it, without waiting for the verdict
+    def perform_async_create(self, serializer):
+        comment = serializer.save(owner=self.request.user, status=ModerationStatus.PENDING)
+        task = moderate_comment.apply_async(args=[comment.id])
+        self.task_started(task)
+        return {'status': 'pending', 'detail': 'Comment is pending moderation.', 'comment_id': comment.id, 'task_id': task.id}
+    
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         response_data = self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
-        if response_data.get('status') == 'success':
-            return Response(data=response_data, status=status.HTTP_201_CREATED, headers=headers)    
-        else:
-            return Response(data=response_data, status=status.HTTP_400_BAD_REQUEST, headers=headers)
+        return self.response_for(response_data, headers)
 
         
 class RetrieveCommentView(generics.RetrieveAPIView):
-    queryset = Comment.objects.all()
+    queryset = approved_comments()
     serializer_class = CommentSerializer
-    authentication_classes = [JWTAuthentication, ]
+    authentication_classes = [CachedJWTAuthentication, ]
     lookup_field = 'id'
         
 
-class ListCommentView(generics.ListAPIView):
-    queryset = Comment.objects.all().order_by('created_at')
+class ListCommentView(CachedListMixin, generics.ListAPIView):
+    queryset = approved_comments().order_by('created_at')
     serializer_class =  CommentSerializer
-    authentication_classes = [JWTAuthentication, ]
-    filter_backends = [DjangoFilterBackend]
+    authentication_classes = [CachedJWTAuthentication, ]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter]
     filterset_class = CommentFilter
-    pagination_class = ItemPagination
+    pagination_class = KeysetPagination
+    cache_scopes = ('comments', )
+    
+    # lists filtered by ?post= only depend on that post's comments
+    def get_cache_scopes(self):
+        post_id = self.request.query_params.get('post')
+        if post_id:
+            return [f'post_{post_id}']
+        return super().get_cache_scopes()
+    
+
+# moderation status of own comment (for clients without websocket)
+class CommentStatusView(generics.RetrieveAPIView):
+    queryset = Comment.objects.all()
+    serializer_class = CommentStatusSerializer
+    authentication_classes = [CachedJWTAuthentication, ]
+    permission_classes = (IsAuthenticated, IsOwner)
+    lookup_field = 'id'
     
 
 class UpdateCommentView(generics.UpdateAPIView):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
-    authentication_classes = [JWTAuthentication, ]
+    authentication_classes = [CachedJWTAuthentication, ]
     permission_classes = (IsAuthenticated, IsOwner)
     lookup_field = 'id'
     
+    # an approved comment moved to another post is counted there instead
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_post_id = serializer.instance.post_id
+        comment = serializer.save()
+        if comment.post_id != previous_post_id:
+            # post_save only bumps the comment's new post
+            bump_generation_on_commit(f'post_{previous_post_id}')
+        if comment.post_id != previous_post_id and comment.status == ModerationStatus.APPROVED:
+            comment_removed(previous_post_id)
+            comment_added(comment.post_id, comment.created_at)
+    
 class DeleteCommentView(generics.DestroyAPIView):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
-    authentication_classes = [JWTAuthentication, ]
+    authentication_classes = [CachedJWTAuthentication, ]
     permission_classes = (IsAuthenticated, IsOwner)
     lookup_field = 'id'
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        if instance.status == ModerationStatus.APPROVED:
+            comment_removed(instance.post_id)
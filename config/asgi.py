@@ -1,6 +1,7 @@
 import os
 import django
 from channels.routing import ProtocolTypeRouter, URLRouter
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
@@ -9,13 +10,18 @@ django.setup()
 from accounts.middleware import JWTAuthMiddleware
 from posts import routing as posts_routing
 from comments import routing as comments_routing
+from config.middleware import InstrumentationASGIMiddleware
 
 
+websocket_application = JWTAuthMiddleware(
+    URLRouter(
+        posts_routing.websocket_urlpatterns + comments_routing.websocket_urlpatterns
+    )
+)
+if settings.INSTRUMENTATION:
+    websocket_application = InstrumentationASGIMiddleware(websocket_application)
+
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": JWTAuthMiddleware(
-        URLRouter(
-            posts_routing.websocket_urlpatterns + comments_routing.websocket_urlpatterns
-        )
-    ),
+    "websocket": websocket_application,
 })
\ No newline at end of file
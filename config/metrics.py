@@ -0,0 +1,306 @@
+import functools
+import heapq
+import inspect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+"""
+Request profiling and Prometheus metrics
+
+A Profile is opened per HTTP request / websocket message by the middlewares in config.middleware.
+Code inside it reports time with `stage(name)` ('auth', 'cache', 'serialize', 'task_wait', ...),
+DB queries are timed by a connection execute wrapper. Stage times are exclusive: a query run
+while building a cached page counts as 'db', not 'cache'; what's left over is 'other'.
+
+Finished profiles are aggregated per (protocol, method, route), the slow ones are kept in a
+ring buffer, and render_prometheus() exports both along with the stats of the app caches.
+"""
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOWEST_QUERIES = 5
+# label sets beyond this are aggregated as method="other", route="other"
+MAX_SERIES = 500
+
+
+class Profile:
+    """ Stage timings of one request
+
+    Args:
+        protocol (str): 'http' or 'websocket'
+        method (str): HTTP method, websocket event ('connect', 'receive', ...) or action
+        route (str): URL pattern (bounded label, no ids)
+    """
+    def __init__(self, protocol: str, method: str, route: str):
+        self.protocol = protocol
+        self.method = method
+        self.route = route
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> [calls, seconds]
+        self.counters = {}  # name -> count, e.g. verdict cache hits (see count())
+        self.queries = []  # heap of the slowest (seconds, sql)
+        self._stack = []  # [started, seconds spent in nested stages]
+
+    def add(self, name: str, seconds: float, calls: int = 1):
+        entry = self.stages.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+
+    def add_query(self, sql: str, seconds: float):
+        item = (seconds, sql[:500])
+        if len(self.queries) < SLOWEST_QUERIES:
+            heapq.heappush(self.queries, item)
+        elif item > self.queries[0]:
+            heapq.heapreplace(self.queries, item)
+
+
+class ProfileSlot:
+    # mutable holder, so tasks/threads that copied the context see profiles opened later
+    __slots__ = ('profile', )
+
+    def __init__(self, profile: Profile = None):
+        self.profile = profile
+
+
+_slot = ContextVar('profile_slot', default=None)
+
+
+def current_profile():
+    slot = _slot.get()
+    return slot.profile if slot is not None else None
+
+
+def bind_slot(slot: ProfileSlot):
+    """ Makes `slot` current for this context, returns the token for `_slot.reset()` """
+    return _slot.set(slot)
+
+
+def unbind_slot(token):
+    _slot.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """ Adds the block's time (minus nested stages) to the current profile's `name` stage """
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    frame = [time.perf_counter(), 0.0]
+    profile._stack.append(frame)
+    try:
+        yield
+    finally:
+        profile._stack.pop()
+        elapsed = time.perf_counter() - frame[0]
+        if profile._stack:
+            profile._stack[-1][1] += elapsed
+        profile.add(name, elapsed - frame[1])
+
+
+def count(name: str, value: int = 1):
+    """ Adds `value` to the current profile's `name` counter (no-op outside a profile) """
+    profile = current_profile()
+    if profile is not None:
+        profile.counters[name] = profile.counters.get(name, 0) + value
+
+
+def staged(name: str):
+    """ Decorator version of stage() for functions and coroutine functions """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    profile = current_profile()
+    if profile is None:
+        return execute(sql, params, many, context)
+    with stage('db'):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            profile.add_query(sql, time.perf_counter() - started)
+
+
+def _install_wrapper(connection, **kwargs):
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+def install_query_hook():
+    """ Times queries of every connection (open ones and those created later) """
+    connection_created.connect(_install_wrapper, dispatch_uid='metrics_query_hook')
+    for connection in connections.all(initialized_only=True):
+        _install_wrapper(connection)
+
+
+# aggregated request metrics
+
+_lock = threading.Lock()
+_requests = {}
+_slow_requests = None
+
+
+def _slow_buffer() -> deque:
+    global _slow_requests
+    if _slow_requests is None:
+        _slow_requests = deque(maxlen=settings.INSTRUMENTATION_SLOW_BUFFER)
+    return _slow_requests
+
+
+def finish(profile: Profile, status=None):
+    """ Records a finished profile: duration histogram, stage totals and (if slow) a sample """
+    duration = time.perf_counter() - profile.started
+    staged_seconds = sum(seconds for _, seconds in profile.stages.values())
+    profile.add('other', max(0.0, duration - staged_seconds))
+
+    labels = (profile.protocol, profile.method, profile.route)
+    with _lock:
+        if labels not in _requests and len(_requests) >= MAX_SERIES:
+            labels = (profile.protocol, 'other', 'other')
+        entry = _requests.get(labels)
+        if entry is None:
+            entry = _requests[labels] = {'count': 0, 'seconds': 0.0, 'buckets': [0] * len(DURATION_BUCKETS), 'stages': {}}
+        entry['count'] += 1
+        entry['seconds'] += duration
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                entry['buckets'][i] += 1
+        for name, (calls, seconds) in profile.stages.items():
+            totals = entry['stages'].setdefault(name, [0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+
+        if duration * 1000 >= settings.INSTRUMENTATION_SLOW_MS:
+            _slow_buffer().append({
+                'protocol': profile.protocol,
+                'method': profile.method,
+                'route': profile.route,
+                'status': status,
+                'finished_at': time.time(),
+                'duration_ms': round(duration * 1000, 3),
+                'stages': {name: {'calls': calls, 'ms': round(seconds * 1000, 3)} for name, (calls, seconds) in profile.stages.items()},
+                'slowest_queries': [{'ms': round(seconds * 1000, 3), 'sql': sql} for seconds, sql in sorted(profile.queries, reverse=True)],
+            })
+
+
+def slow_requests() -> list:
+    """ Sampled slow requests, most recent first """
+    with _lock:
+        return list(reversed(_slow_buffer()))
+
+
+def reset():
+    with _lock:
+        _requests.clear()
+        _slow_buffer().clear()
+
+
+# exported stats of the app's caches and queues: name -> (stats function, label of nested dicts)
+
+_collectors = {}
+_defaults_registered = False
+
+
+def register_collector(name: str, func, label: str = None):
+    """ Exports the numeric values of `func()` as `app_<name>_<key>` gauges
+
+    Nested dicts (e.g. stats per consumer class) are exported with their key as `label`.
+    """
+    _collectors[name] = (func, label)
+
+
+def _register_default_collectors():
+    global _defaults_registered
+    from accounts.authentication import token_cache
+    from posts.backpressure import backpressure_stats
+    from posts.broadcast import broadcast_stats
+    from posts.page_cache import page_cache_stats
+    from posts.utils import verdict_cache
+
+    _defaults_registered = True
+
+    register_collector('page_cache', page_cache_stats)
+    register_collector('jwt_cache', token_cache.stats)
+    register_collector('verdict_cache', verdict_cache.stats)
+    register_collector('broadcast', broadcast_stats)
+    register_collector('ws_send_queue', backpressure_stats, label='consumer')
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}' if labels else ''
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def render_prometheus() -> str:
+    """ Returns all metrics in the Prometheus text exposition format """
+    if not _defaults_registered:
+        _register_default_collectors()
+    lines = [
+        '# HELP app_request_duration_seconds Request (websocket: message) handling time',
+        '# TYPE app_request_duration_seconds histogram',
+    ]
+    with _lock:
+        requests = {labels: {**entry, 'stages': {name: list(totals) for name, totals in entry['stages'].items()}}
+                    for labels, entry in _requests.items()}
+    for (protocol, method, route), entry in sorted(requests.items()):
+        labels = {'protocol': protocol, 'method': method, 'route': route}
+        for bound, count in zip(DURATION_BUCKETS, entry['buckets']):
+            lines.append(f'app_request_duration_seconds_bucket{_labels(**labels, le=bound)} {count}')
+        lines.append(f'app_request_duration_seconds_bucket{_labels(**labels, le="+Inf")} {entry["count"]}')
+        lines.append(f'app_request_duration_seconds_sum{_labels(**labels)} {entry["seconds"]!r}')
+        lines.append(f'app_request_duration_seconds_count{_labels(**labels)} {entry["count"]}')
+
+    lines += [
+        '# HELP app_request_stage_seconds_total Time spent per request stage (exclusive of nested stages)',
+        '# TYPE app_request_stage_seconds_total counter',
+    ]
+    stage_calls = [
+        '# HELP app_request_stage_calls_total Stage entries (for db: queries) per request stage',
+        '# TYPE app_request_stage_calls_total counter',
+    ]
+    for (protocol, method, route), entry in sorted(requests.items()):
+        for name, (calls, seconds) in sorted(entry['stages'].items()):
+            labels = _labels(protocol=protocol, method=method, route=route, stage=name)
+            lines.append(f'app_request_stage_seconds_total{labels} {seconds!r}')
+            stage_calls.append(f'app_request_stage_calls_total{labels} {calls}')
+    lines += stage_calls
+
+    for name, (func, label) in sorted(_collectors.items()):
+        samples = {}
+        for key, value in func().items():
+            if isinstance(value, dict):
+                for nested_key, nested_value in value.items():
+                    samples.setdefault(nested_key, []).append((_labels(**{label or 'key': key}), nested_value))
+            else:
+                samples.setdefault(key, []).append(('', value))
+        for key, values in sorted(samples.items()):
+            metric = f'app_{name}_{key}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines += [f'{metric}{labels} {_number(value)}' for labels, value in values if isinstance(value, (int, float))]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,89 @@
+import json
+import re
+import time
+
+from .metrics import Profile, ProfileSlot, bind_slot, current_profile, finish, install_query_hook, unbind_slot
+"""
+Request instrumentation (opt-in with INSTRUMENTATION=True)
+
+InstrumentationMiddleware profiles HTTP requests, InstrumentationASGIMiddleware wraps the
+websocket stack and profiles the connect handshake (incl. JWT auth) and every message.
+"""
+
+_ID_RE = re.compile(r'\d+')
+
+
+class InstrumentationMiddleware:
+    """ Django middleware: one profile per request, labelled with the resolved URL pattern """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_query_hook()
+
+    def __call__(self, request):
+        profile = Profile('http', request.method, 'unmatched')
+        token = bind_slot(ProfileSlot(profile))
+        try:
+            response = self.get_response(request)
+        finally:
+            unbind_slot(token)
+        if request.resolver_match is not None:
+            profile.route = request.resolver_match.route
+        finish(profile, response.status_code)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook, the callback runs once they are
+        profile = current_profile()
+        if profile is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda response: profile.add('render', time.perf_counter() - started))
+        return response
+
+
+def _message_method(message: dict) -> str:
+    event = message['type'].rsplit('.', 1)[-1]
+    if event == 'receive' and message.get('text'):
+        try:
+            action = json.loads(message['text']).get('action')
+        except (ValueError, AttributeError):
+            action = None
+        if isinstance(action, str) and action.isidentifier():
+            return f'receive:{action}'
+    return event
+
+
+class InstrumentationASGIMiddleware:
+    """ ASGI middleware for websocket connections
+
+    The first profile covers everything up to the connect event being handled; after that
+    a profile starts when a message is received and ends when the consumer asks for the next
+    one, so time spent idle between messages is not counted. Routes have ids replaced by <id>.
+    """
+    def __init__(self, inner):
+        self.inner = inner
+        install_query_hook()
+
+    async def __call__(self, scope, receive, send):
+        route = _ID_RE.sub('<id>', scope['path'])
+        slot = ProfileSlot(Profile(scope['type'], 'connect', route))
+        dispatched = False
+
+        async def profiled_receive():
+            nonlocal dispatched
+            if slot.profile is not None and dispatched:
+                finish(slot.profile)
+                slot.profile = None
+            message = await receive()
+            if slot.profile is None:
+                slot.profile = Profile(scope['type'], _message_method(message), route)
+            dispatched = True
+            return message
+
+        token = bind_slot(slot)
+        try:
+            return await self.inner(scope, profiled_receive, send)
+        finally:
+            unbind_slot(token)
+            if slot.profile is not None:
+                finish(slot.profile)
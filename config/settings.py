@@ -11,8 +11,10 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 import os
 from pathlib import Path
-from decouple import AutoConfig
+from decouple import AutoConfig, Csv
 from datetime import timedelta
+from celery.schedules import crontab
+from kombu import Queue
 
 config = AutoConfig()
 
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     #side apps
     'rest_framework',
@@ -97,6 +100,15 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
 ]
 
+# request instrumentation (config.metrics): per-stage timings of HTTP requests and websocket
+# messages, slow request samples at /metrics/slow/ and Prometheus metrics at /metrics/
+INSTRUMENTATION = config('INSTRUMENTATION', default=False, cast=bool)
+if INSTRUMENTATION:
+    MIDDLEWARE.insert(0, 'config.middleware.InstrumentationMiddleware')
+INSTRUMENTATION_SLOW_MS = config('INSTRUMENTATION_SLOW_MS', default=500, cast=int)
+INSTRUMENTATION_SLOW_BUFFER = config('INSTRUMENTATION_SLOW_BUFFER', default=100, cast=int)
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'posts.pagination.ItemPagination',
     'PAGE_SIZE': 25
@@ -143,6 +155,11 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
 }
 
+# verified access tokens are mapped to their user in-process (accounts.authentication),
+# entries never outlive the token; user changes (e.g. deactivation) reach other processes within the TTL
+JWT_USER_CACHE_TTL = config('JWT_USER_CACHE_TTL', default=60, cast=int)
+JWT_USER_CACHE_SIZE = config('JWT_USER_CACHE_SIZE', default=10000, cast=int)
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -198,7 +215,32 @@ CHANNEL_LAYERS = {
             "prefix": "channels",
         },
     },
+    # hot broadcast groups (posts_group, post_<id>): one PUBLISH per event, each ASGI process
+    # subscribes to a group once and fans out to its sockets locally
+    'broadcast': {
+        'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+        'CONFIG': {
+            "hosts": [config('REDIS_URL', default='redis://redis:6379/1')],
+            "prefix": "broadcast",
+        },
+    },
+}
+# channel layer alias used by feed consumers and broadcasts (set to 'default' to disable pub/sub)
+BROADCAST_CHANNEL_LAYER = config('BROADCAST_CHANNEL_LAYER', default='broadcast')
+# buffer new post/comment broadcasts per group for this many ms and send them as one batch (0 = off)
+BROADCAST_COALESCE_MS = config('BROADCAST_COALESCE_MS', default=0, cast=int)
+# per-socket broadcast queue (posts.backpressure): at HIGH frames the slow-consumer policy
+# (drop_oldest down to LOW, resync or disconnect) is applied
+WS_SEND_QUEUE_HIGH = config('WS_SEND_QUEUE_HIGH', default=256, cast=int)
+WS_SEND_QUEUE_LOW = config('WS_SEND_QUEUE_LOW', default=64, cast=int)
+WS_SLOW_CONSUMER_POLICY = config('WS_SLOW_CONSUMER_POLICY', default='drop_oldest')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_URL', default='redis://redis:6379/2'),
+    },
 }
+
 # CELERY_BROKER_URL = 'redis://localhost:6379/1'
 # CELERY_RESULT_BACKEND = 'redis://localhost:6379/1'
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://redis:6379/1')
@@ -207,6 +249,74 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# routing: BERT inference gets its own queue and workers, so page loads never wait behind a
+# moderation backlog; workers pick a queue with -Q (see docker-compose.yml)
+CELERY_DEFAULT_QUEUE = 'celery'
+CELERY_QUEUES = (Queue('celery'), Queue('moderation'), Queue('reads'))
+# priority 0 is the highest (redis): creates that a client is waiting on go before background moderation
+CELERY_ROUTES = {
+    'posts.tasks.create_post': {'queue': 'moderation', 'priority': 0},
+    'comments.tasks.create_comment': {'queue': 'moderation', 'priority': 0},
+    'posts.tasks.moderate_post': {'queue': 'moderation', 'priority': 5},
+    'comments.tasks.moderate_comment': {'queue': 'moderation', 'priority': 5},
+    'posts.tasks.get_posts_task': {'queue': 'reads', 'priority': 0},
+    'comments.tasks.get_comments': {'queue': 'reads', 'priority': 0},
+}
+CELERY_DEFAULT_PRIORITY = 5
+# redis emulates priorities with one list per step; a worker consuming several queues drains them in -Q order
+BROKER_TRANSPORT_OPTIONS = {'priority_steps': list(range(10)), 'sep': ':', 'queue_order_strategy': 'priority'}
+# a worker process reserves one task at a time: a slow inference doesn't hold prefetched tasks back
+CELERYD_PREFETCH_MULTIPLIER = config('CELERY_PREFETCH_MULTIPLIER', default=1, cast=int)
+CELERYBEAT_SCHEDULE = {
+    'flush-expired-tokens': {
+        'task': 'accounts.tasks.flush_expired_tokens',
+        'schedule': crontab(minute=0),  # hourly
+    },
+    'purge-idempotency-records': {
+        'task': 'posts.tasks.purge_idempotency_records',
+        'schedule': crontab(minute=30, hour=3),  # daily
+    },
+}
+# with INSTRUMENTATION on, finished tasks are appended here (NDJSON) for `manage.py task_latency_report`;
+# set it for the workers (e.g. a shared volume), /metrics/ doesn't cover worker processes. Empty = not recorded
+TASK_METRICS_FILE = config('TASK_METRICS_FILE', default='')
+# expired refresh tokens deleted per DELETE statement
+TOKEN_FLUSH_BATCH_SIZE = config('TOKEN_FLUSH_BATCH_SIZE', default=5000, cast=int)
+
+# toxicity classifier (posts.utils)
+# the model is loaded lazily; set MODERATION_PRELOAD_MODEL on celery workers to load it once in the parent process
+MODERATION_PIPELINE = config('MODERATION_PIPELINE', default='posts.utils.load_pipeline')
+MODERATION_PRELOAD_MODEL = config('MODERATION_PRELOAD_MODEL', default=False, cast=bool)
+# texts of concurrent callers are collected for up to MODERATION_MAX_WAIT_MS and classified in one
+# padded batch (a lone caller doesn't wait; batching needs a threaded worker pool, see docker-compose.yml)
+MODERATION_MAX_BATCH_SIZE = config('MODERATION_MAX_BATCH_SIZE', default=32, cast=int)
+MODERATION_MAX_WAIT_MS = config('MODERATION_MAX_WAIT_MS', default=5, cast=float)
+# verdicts are cached by normalized text hash; bump the model version to invalidate them
+MODERATION_MODEL_VERSION = config('MODERATION_MODEL_VERSION', default='JungleLee/bert-toxic-comment-classification:1')
+MODERATION_CACHE_ALIAS = 'default'
+MODERATION_CACHE_TTL = config('MODERATION_CACHE_TTL', default=60 * 60 * 24, cast=int)
+MODERATION_CACHE_LOCAL_SIZE = config('MODERATION_CACHE_LOCAL_SIZE', default=10000, cast=int)
+
+# text search configuration used for post/comment search vectors (PostgreSQL); other databases
+# search a per-process index (posts.search.InvertedIndex), rebuilt when a write from any process
+# bumps the page cache generation, so there it needs a shared CACHES backend like the pages do
+SEARCH_CONFIG = 'english'
+
+# post/comment list pages (posts.page_cache) are cached per generation, writes bump the generation
+PAGE_CACHE_TTL = config('PAGE_CACHE_TTL', default=60 * 5, cast=int)
+# a missing page is rebuilt by one caller, the others wait for it up to PAGE_CACHE_WAIT seconds
+PAGE_CACHE_LOCK_TIMEOUT = 10
+PAGE_CACHE_WAIT = config('PAGE_CACHE_WAIT', default=2, cast=float)
+
+# responses of create requests sent with an Idempotency-Key are kept this long (posts.idempotency);
+# a retry of a request still waiting on its task waits up to IDEMPOTENCY_WAIT seconds on the same task
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', default=60 * 60 * 24, cast=int)
+IDEMPOTENCY_WAIT = config('IDEMPOTENCY_WAIT', default=30, cast=float)
+# a request that stored no response within this many seconds is presumed dead, retries re-claim its key
+IDEMPOTENCY_LEASE = config('IDEMPOTENCY_LEASE', default=120, cast=int)
+
+# create endpoints return 202 right away and moderate in background instead of waiting for the celery result
+ASYNC_CREATE = config('ASYNC_CREATE', default=False, cast=bool)
 
 
 # Password validation
@@ -228,6 +338,21 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# preferred hasher first: older hashes are upgraded on successful login (accounts.hashers)
+PASSWORD_HASHERS = [
+    'accounts.hashers.TunedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# 720000 is Django 5.0's default, measure with `python manage.py bench_login` before tuning
+PASSWORD_HASH_ITERATIONS = config('PASSWORD_HASH_ITERATIONS', default=720000, cast=int)
+# login hashing pool: worker threads and the number of hashes allowed in flight before shedding with 429
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 1, cast=int)
+PASSWORD_HASH_MAX_PENDING = config('PASSWORD_HASH_MAX_PENDING', default=64, cast=int)
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
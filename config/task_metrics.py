@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+import time
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+
+from .metrics import Profile, ProfileSlot, bind_slot, finish, install_query_hook, unbind_slot
+"""
+Celery task instrumentation (connected in celery_app.py when INSTRUMENTATION is on)
+
+Publishing stamps the message with its enqueue time; the worker opens a Profile per task
+(protocol "celery", method = task name, route = queue) whose duration starts at enqueue, so
+'queue_wait' is a stage next to 'classify', 'db', 'broadcast', 'cache' and 'serialize'.
+Finished tasks are appended to TASK_METRICS_FILE as NDJSON for `manage.py task_latency_report`;
+that file is the only output of worker processes (stage timings and counters such as
+verdict cache hits/misses). They are also added to the in-process
+registry, which /metrics/ serves only for tasks run by the web process itself (eager mode).
+"""
+
+ENQUEUED_AT_HEADER = 'enqueued_at'
+
+_tokens = {}
+_file = None
+_file_pid = None
+_file_lock = threading.Lock()
+
+
+def _stamp_enqueue_time(headers=None, **kwargs):
+    if headers is not None:
+        headers[ENQUEUED_AT_HEADER] = time.time()
+
+
+def _queue_name(task) -> str:
+    delivery_info = task.request.delivery_info or {}
+    return delivery_info.get('routing_key') or ('eager' if task.request.is_eager else 'unknown')
+
+
+def _enqueued_at(request):
+    # workers merge message headers into the request, eager calls keep them under `headers`
+    return getattr(request, ENQUEUED_AT_HEADER, None) or (request.headers or {}).get(ENQUEUED_AT_HEADER)
+
+
+def _start_task(task_id=None, task=None, **kwargs):
+    profile = Profile('celery', task.name, _queue_name(task))
+    enqueued_at = _enqueued_at(task.request)
+    if enqueued_at is not None:
+        waited = max(0.0, time.time() - enqueued_at)
+        profile.started -= waited
+        profile.add('queue_wait', waited)
+    _tokens[task_id] = (profile, bind_slot(ProfileSlot(profile)))
+
+
+def _finish_task(task_id=None, task=None, state=None, **kwargs):
+    entry = _tokens.pop(task_id, None)
+    if entry is None:
+        return
+    profile, token = entry
+    unbind_slot(token)
+    finish(profile, state)
+    if settings.TASK_METRICS_FILE:
+        write_record(profile, state)
+
+
+def write_record(profile: Profile, state: str):
+    record = {
+        'task': profile.method,
+        'queue': profile.route,
+        'state': state,
+        'finished_at': time.time(),
+        'seconds': sum(seconds for _, seconds in profile.stages.values()),
+        'stages': {name: seconds for name, (_, seconds) in profile.stages.items()},
+        'counters': profile.counters,
+    }
+    global _file, _file_pid
+    with _file_lock:
+        # one handle per (prefork) process, lines are written with a single append each
+        if _file is None or _file_pid != os.getpid():
+            _file = open(settings.TASK_METRICS_FILE, 'a', buffering=1)
+            _file_pid = os.getpid()
+        _file.write(json.dumps(record) + '\n')
+
+
+def read_records(path: str, task: str = None, since: float = None):
+    """ Yields recorded task records, optionally for one task and finished after `since` (timestamp) """
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # partially written last line
+            if task and record['task'] != task:
+                continue
+            if since and record['finished_at'] < since:
+                continue
+            yield record
+
+
+def connect_signals():
+    before_task_publish.connect(_stamp_enqueue_time, dispatch_uid='task_metrics_publish')
+    task_prerun.connect(_start_task, dispatch_uid='task_metrics_prerun')
+    task_postrun.connect(_finish_task, dispatch_uid='task_metrics_postrun')
+    install_query_hook()
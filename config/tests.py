@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from asgiref.testing import ApplicationCommunicator
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from channels.routing import URLRouter
+from django.core.management import call_command
+from django.test import TestCase, modify_settings, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from accounts.middleware import JWTAuthMiddleware
+from accounts.models import User
+from posts.models import Post
+from posts import routing as posts_routing
+from posts.management.commands.task_latency_report import percentile
+from posts.tasks import create_post
+from celery_app import app
+from . import metrics, task_metrics
+from .middleware import InstrumentationASGIMiddleware
+
+
+class StageTests(TestCase):
+    def test_nested_stages_are_exclusive(self):
+        profile = metrics.Profile('http', 'GET', 'test/')
+        token = metrics.bind_slot(metrics.ProfileSlot(profile))
+        try:
+            with metrics.stage('cache'):
+                with metrics.stage('serialize'):
+                    time.sleep(0.05)
+        finally:
+            metrics.unbind_slot(token)
+
+        self.assertEqual(set(profile.stages), {'cache', 'serialize'})
+        self.assertGreaterEqual(profile.stages['serialize'][1], 0.05)
+        self.assertLess(profile.stages['cache'][1], 0.05)
+
+    def test_stage_without_profile_is_a_no_op(self):
+        with metrics.stage('cache'):
+            pass
+        self.assertIsNone(metrics.current_profile())
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'config.middleware.InstrumentationMiddleware'})
+@override_settings(INSTRUMENTATION_SLOW_MS=0)
+class InstrumentationMiddlewareTests(APITestCase):
+    def setUp(self):
+        metrics.reset()
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        Post.objects.create(text='Post', owner=self.user)
+
+    def test_request_is_profiled_by_route(self):
+        self.client.get(reverse('post-list'))
+
+        slow = metrics.slow_requests()
+        self.assertEqual(len(slow), 1)
+        self.assertEqual((slow[0]['method'], slow[0]['route'], slow[0]['status']), ('GET', 'api/posts/list/', 200))
+        self.assertGreater(slow[0]['stages']['db']['calls'], 0)
+        self.assertIn('cache', slow[0]['stages'])
+        self.assertIn('render', slow[0]['stages'])
+        self.assertTrue(slow[0]['slowest_queries'])
+
+        body = metrics.render_prometheus()
+        self.assertIn('app_request_duration_seconds_count{protocol="http",method="GET",route="api/posts/list/"} 1', body)
+        self.assertIn('app_request_stage_calls_total{protocol="http",method="GET",route="api/posts/list/",stage="db"}', body)
+
+    def test_metrics_endpoint(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('app_page_cache_hits', response.content.decode())
+        self.assertIn('app_jwt_cache_hit_rate', response.content.decode())
+
+        self.assertEqual(self.client.get(reverse('metrics-slow'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class InstrumentationASGIMiddlewareTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        # the test database connection is already open, new connections get the hook on connect
+        metrics.install_query_hook()
+        user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        Post.objects.create(text='Post', owner=user)
+
+    async def test_websocket_messages_are_profiled(self):
+        application = InstrumentationASGIMiddleware(JWTAuthMiddleware(URLRouter(posts_routing.websocket_urlpatterns)))
+        scope = {'type': 'websocket', 'path': '/ws/posts/', 'headers': [], 'query_string': b'', 'subprotocols': []}
+        communicator = ApplicationCommunicator(application, scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'action': 'get_posts', 'request_id': 1, 'page_num': 1})})
+        await communicator.receive_output()
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+        body = metrics.render_prometheus()
+        for method in ('connect', 'receive:get_posts', 'disconnect'):
+            self.assertIn(f'app_request_duration_seconds_count{{protocol="websocket",method="{method}",route="/ws/posts/"}} 1', body)
+        self.assertIn('app_request_stage_calls_total{protocol="websocket",method="receive:get_posts",route="/ws/posts/",stage="db"}', body)
+
+
+class TaskMetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        task_metrics.connect_signals()
+        self.addCleanup(task_prerun.disconnect, dispatch_uid='task_metrics_prerun')
+        self.addCleanup(task_postrun.disconnect, dispatch_uid='task_metrics_postrun')
+        self.addCleanup(before_task_publish.disconnect, dispatch_uid='task_metrics_publish')
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        records = tempfile.NamedTemporaryFile(suffix='.ndjson', delete=False)
+        records.close()
+        self.records_path = records.name
+        self.addCleanup(os.remove, self.records_path)
+        # tasks run in-process, whatever the test settings say
+        self.addCleanup(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+
+    @patch('posts.utils.classifier.classify', return_value={'label': 'non-toxic', 'score': 0.98})
+    def test_task_stages_are_recorded_and_reported(self, mock_classify):
+        with override_settings(TASK_METRICS_FILE=self.records_path):
+            for i in range(3):
+                create_post.apply_async(args=[self.user.id, {'text': f'Post {i}'}], headers={'enqueued_at': time.time() - 0.2}).get()
+        task_metrics._file.close()
+        task_metrics._file = None
+
+        records = list(task_metrics.read_records(self.records_path))
+        self.assertEqual(len(records), 3)
+        self.assertEqual((records[0]['task'], records[0]['state']), ('posts.tasks.create_post', 'SUCCESS'))
+        self.assertGreaterEqual(records[0]['stages']['queue_wait'], 0.2)
+        self.assertGreaterEqual(records[0]['seconds'], 0.2)
+        self.assertTrue({'classify', 'db', 'broadcast'} <= set(records[0]['stages']))
+        self.assertIn('app_request_duration_seconds_count{protocol="celery",method="posts.tasks.create_post",route="eager"} 3', metrics.render_prometheus())
+
+        out = io.StringIO()
+        call_command('task_latency_report', file=self.records_path, json=True, stdout=out)
+        report = json.loads(out.getvalue())['posts.tasks.create_post']
+        self.assertEqual((report['count'], report['states']), (3, {'SUCCESS': 3}))
+        self.assertGreaterEqual(report['stages']['queue_wait']['p50'], 200)
+        self.assertEqual(set(report['total']), {'p50', 'p95', 'p99'})
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (50, 95, 99)], [50, 95, 99])
+        self.assertEqual(percentile([7], 99), 7)
@@ -38,6 +38,7 @@ schema_view = get_schema_view(
 )
 
 from posts.views import auth, posts, post_details
+from .views import metrics, slow_requests_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -53,6 +54,10 @@ urlpatterns = [
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     
+    #metrics
+    path('metrics/', metrics, name='metrics'),
+    path('metrics/slow/', slow_requests_view, name='metrics-slow'),
+    
     #local
     path('api/accounts/', include('accounts.urls')),
     path('api/posts/', include('posts.urls')),
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+
+from .metrics import render_prometheus, slow_requests
+"""
+Local metrics endpoints (only served to METRICS_ALLOWED_IPS)
+"""
+
+
+def _allowed(request) -> bool:
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics(request):
+    if not _allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def slow_requests_view(request):
+    if not _allowed(request):
+        return HttpResponseForbidden()
+    return JsonResponse({'results': slow_requests()})
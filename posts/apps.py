@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class PostsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'posts'
+
+    def ready(self):
+        # list page cache invalidation (post & comment writes bump the page generations)
+        from .page_cache import connect_signals
+        connect_signals()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+"""
+Per-connection send queues for websocket broadcasts
+
+Broadcast handlers never await the socket: frames go to a per-connection queue drained by
+a writer task, so a slow client only fills its own queue instead of the channel layer's.
+When the queue reaches WS_SEND_QUEUE_HIGH the slow-consumer policy is applied:
+
+- drop_oldest: oldest frames are dropped down to WS_SEND_QUEUE_LOW
+- resync: the queue is replaced by one {"event_type": "resync"} frame (client reloads)
+- disconnect: the socket is closed with 1013 (try again later)
+"""
+
+POLICIES = ('drop_oldest', 'resync', 'disconnect')
+RESYNC_FRAME = '{"event_type":"resync"}'
+
+_stats = {}
+logger = logging.getLogger(__name__)
+
+
+def _class_stats(consumer) -> dict:
+    name = type(consumer).__name__
+    if name not in _stats:
+        _stats[name] = {'depth': 0, 'max_depth': 0, 'sent': 0, 'dropped': 0, 'resyncs': 0, 'disconnects': 0}
+    return _stats[name]
+
+
+def backpressure_stats() -> dict:
+    """ Queue depth (current total & max per connection) and drops, per consumer class """
+    return {name: dict(stats) for name, stats in _stats.items()}
+
+
+class BackpressureMixin:
+    """ Consumer mixin: `await self.enqueue(text)` instead of `await self.send(text_data=text)` for broadcasts """
+    slow_consumer_policy = None  # defaults to settings.WS_SLOW_CONSUMER_POLICY
+
+    async def enqueue(self, text: str):
+        if getattr(self, '_send_queue', None) is None:
+            self._send_queue = deque()
+            self._send_ready = asyncio.Event()
+            self._send_closed = False
+            self._writer = asyncio.create_task(self._write_queue())
+        if self._send_closed:
+            return
+
+        stats = _class_stats(self)
+        self._send_queue.append(text)
+        stats['depth'] += 1
+        stats['max_depth'] = max(stats['max_depth'], len(self._send_queue))
+        if len(self._send_queue) >= settings.WS_SEND_QUEUE_HIGH:
+            await self._handle_slow_consumer(stats)
+        self._send_ready.set()
+
+    async def _handle_slow_consumer(self, stats: dict):
+        policy = self.slow_consumer_policy or settings.WS_SLOW_CONSUMER_POLICY
+        if policy not in POLICIES:
+            raise ImproperlyConfigured(f'Unknown slow consumer policy {policy!r}, expected one of {POLICIES}')
+        queue = self._send_queue
+        if policy == 'drop_oldest':
+            dropped = max(0, len(queue) - settings.WS_SEND_QUEUE_LOW)
+            for _ in range(dropped):
+                queue.popleft()
+        else:
+            dropped = len(queue)
+            queue.clear()
+        stats['depth'] -= dropped
+        stats['dropped'] += dropped
+
+        if policy == 'resync':
+            stats['resyncs'] += 1
+            queue.append(RESYNC_FRAME)
+            stats['depth'] += 1
+        elif policy == 'disconnect':
+            stats['disconnects'] += 1
+            self._send_closed = True
+            await self.close(code=1013)
+
+    async def _write_queue(self):
+        stats = _class_stats(self)
+        queue = self._send_queue
+        while True:
+            if not queue:
+                self._send_ready.clear()
+                await self._send_ready.wait()
+                continue
+            text = queue.popleft()
+            stats['depth'] -= 1
+            try:
+                # waits while the client's socket buffer is full, that's where the queue grows
+                await self.send(text_data=text)
+            except Exception:
+                # socket gone (e.g. closed under us): stop queueing frames nobody will send
+                logger.debug('websocket send failed, dropping the send queue', exc_info=True)
+                self._send_closed = True
+                stats['depth'] -= len(queue)
+                stats['dropped'] += len(queue) + 1
+                queue.clear()
+                return
+            stats['sent'] += 1
+
+    async def websocket_disconnect(self, message):
+        writer = getattr(self, '_writer', None)
+        if writer is not None:
+            writer.cancel()
+            _class_stats(self)['depth'] -= len(self._send_queue)
+            self._send_queue.clear()
+        await super().websocket_disconnect(message)
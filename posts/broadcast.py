@@ -0,0 +1,206 @@
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+
+from asgiref.sync import async_to_sync
+from celery.signals import worker_process_shutdown
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.exceptions import ChannelFull, StopConsumer
+from channels.layers import get_channel_layer
+from channels.utils import await_many_dispatch
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from config.metrics import staged
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+"""
+Broadcasts to websocket groups ('posts_group', 'post_<id>')
+
+Groups live on the BROADCAST_CHANNEL_LAYER alias. With the Redis pub/sub layer a group_send
+is one PUBLISH: every ASGI process subscribes to a group once and fans the message out to
+its own sockets in memory, instead of one Redis write per socket with capacity-based drops.
+With BROADCAST_COALESCE_MS set, new posts/comments are sent in batches (BroadcastCoalescer).
+
+Events carry the websocket frame already encoded ('text'), consumers forward it as is,
+so fan-out costs no JSON encoding per socket.
+"""
+
+logger = logging.getLogger(__name__)
+
+_stats = {'sent': 0, 'dropped': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def broadcast_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def dumps(data) -> str:
+    # orjson when installed, compact stdlib json otherwise
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(',', ':'))
+
+
+def encode_frame(frame_type: str, key: str, encoded: str, batch: bool = False) -> str:
+    """ Builds a {"event_type": frame_type, key: <encoded>} frame around an already encoded value """
+    batch_flag = ',"batch":true' if batch else ''
+    return f'{{"event_type":{dumps(frame_type)},{dumps(key)}:{encoded}{batch_flag}}}'
+
+
+def broadcast_layer_alias() -> str:
+    # falls back to the default layer where no broadcast layer is configured
+    alias = settings.BROADCAST_CHANNEL_LAYER
+    return alias if alias in settings.CHANNEL_LAYERS else DEFAULT_CHANNEL_LAYER
+
+
+async def agroup_send(group: str, message: dict) -> bool:
+    """ Sends the message to the group, returns False (and counts a drop) when it couldn't be delivered """
+    try:
+        await get_channel_layer(broadcast_layer_alias()).group_send(group, message)
+    except (ChannelFull, RedisError, OSError) as e:
+        _count('dropped')
+        logger.warning('Broadcast to %s dropped: %r', group, e)
+        return False
+    _count('sent')
+    return True
+
+
+@staged('broadcast')
+def group_send(group: str, message: dict) -> bool:
+    return async_to_sync(agroup_send)(group, message)
+
+
+class BroadcastCoalescer:
+    """ Buffers broadcast events per group and sends them as one batch message
+
+    The first event for a group starts a timer of BROADCAST_COALESCE_MS; events arriving
+    meanwhile join the buffer and the whole batch goes out with one group_send as
+    `<event type>_batch`, its frame holding the list of items under the same key.
+    Items are buffered encoded, the batch frame is assembled by concatenation.
+
+    Other messages to a group go through `send()`, which flushes the group's buffered batches
+    first, so e.g. a verdict never reaches clients before the post it is about.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # held while sending, so a flush running on a timer thread can't be overtaken
+        self._send_lock = threading.RLock()
+        self._pid = None
+        self._pending = {}
+
+    def add(self, group: str, event_type: str, frame_type: str, key: str, encoded: str):
+        with self._lock:
+            # buffered events & timers don't survive fork
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending = {}
+            batch_key = (group, event_type, frame_type, key)
+            if batch_key in self._pending:
+                self._pending[batch_key].append(encoded)
+                return
+            self._pending[batch_key] = [encoded]
+
+        timer = threading.Timer(settings.BROADCAST_COALESCE_MS / 1000, self.flush, args=(batch_key, ))
+        timer.daemon = True
+        timer.start()
+
+    def flush(self, batch_key: tuple):
+        with self._send_lock:
+            with self._lock:
+                items = self._pending.pop(batch_key, None)
+            if items:
+                group, event_type, frame_type, key = batch_key
+                text = encode_frame(frame_type, key, '[' + ','.join(items) + ']', batch=True)
+                group_send(group, {'type': f'{event_type}_batch', 'text': text})
+
+    def send(self, group: str, message: dict):
+        """ Sends a message to the group right after the group's buffered batches """
+        with self._send_lock:
+            with self._lock:
+                batch_keys = [batch_key for batch_key in self._pending if batch_key[0] == group]
+            for batch_key in batch_keys:
+                self.flush(batch_key)
+            group_send(group, message)
+
+    def flush_all(self):
+        with self._lock:
+            batch_keys = list(self._pending)
+        for batch_key in batch_keys:
+            self.flush(batch_key)
+
+
+coalescer = BroadcastCoalescer()
+# events still buffered when a process exits are sent right away; prefork celery children
+# leave with os._exit (no atexit handlers), so they flush on worker_process_shutdown
+atexit.register(coalescer.flush_all)
+worker_process_shutdown.connect(lambda **kwargs: coalescer.flush_all(), weak=False, dispatch_uid='broadcast_flush_on_shutdown')
+
+
+def broadcast_event(group: str, event_type: str, frame_type: str, key: str, item: dict):
+    """ Sends `item` as a {"event_type": frame_type, key: item} frame to the group's `event_type` handler
+
+    The item is encoded once here; with coalescing enabled it's buffered into a batch instead.
+    """
+    encoded = dumps(item)
+    if settings.BROADCAST_COALESCE_MS > 0:
+        coalescer.add(group, event_type, frame_type, key, encoded)
+    else:
+        group_send(group, {'type': event_type, 'text': encode_frame(frame_type, key, encoded)})
+
+
+def broadcast_frame(group: str, event_type: str, frame: dict):
+    """ Sends a whole frame (encoded once) to the group's `event_type` handler, after buffered events """
+    message = {'type': event_type, 'text': dumps(frame)}
+    if settings.BROADCAST_COALESCE_MS > 0:
+        coalescer.send(group, message)
+    else:
+        group_send(group, message)
+
+
+class BroadcastGroupsMixin:
+    """ Consumer mixin: joins the broadcast groups on the broadcast layer
+
+    The consumer's own channel stays on the default layer, which djangochannelsrestframework's
+    model observers (subscribe_instance) publish to. Broadcast groups are joined with a second
+    channel on broadcast_layer_alias(), read alongside it (one channel when both are the same).
+    """
+    async def __call__(self, scope, receive, send):
+        # AsyncConsumer.__call__ with the extra broadcast channel
+        self.scope = scope
+        self.channel_layer = get_channel_layer(self.channel_layer_alias)
+        self.channel_name = await self.channel_layer.new_channel()
+        self.channel_receive = functools.partial(self.channel_layer.receive, self.channel_name)
+        receivers = [receive, self.channel_receive]
+
+        self.broadcast_layer = get_channel_layer(broadcast_layer_alias())
+        if self.broadcast_layer is self.channel_layer:
+            self.broadcast_channel_name = self.channel_name
+        else:
+            self.broadcast_channel_name = await self.broadcast_layer.new_channel()
+            receivers.append(functools.partial(self.broadcast_layer.receive, self.broadcast_channel_name))
+
+        self.base_send = send
+        try:
+            await await_many_dispatch(receivers, self.dispatch)
+        except StopConsumer:
+            pass
+
+    async def broadcast_group_add(self, group: str):
+        await self.broadcast_layer.group_add(group, self.broadcast_channel_name)
+
+    async def broadcast_group_discard(self, group: str):
+        await self.broadcast_layer.group_discard(group, self.broadcast_channel_name)
@@ -0,0 +1,227 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.models import User
+from comments.models import Comment
+from .models import Post, ModerationStatus
+from .counters import reconcile_comment_counters
+from .page_cache import bump_generation
+from .utils import check_many_for_obscence, verdict_cache
+"""
+Bulk import/export of posts and comments (NDJSON or CSV)
+
+Import reads records in batches, moderates each batch with one classifier call and writes
+it with bulk_create (COPY on PostgreSQL). Export streams rows from a server-side cursor.
+"""
+
+FORMATS = ('ndjson', 'csv')
+
+# exported columns; import accepts the same (id only with keep_ids)
+FIELDS = {
+    'posts': (Post, ['id', 'owner', 'text', 'created_at', 'status']),
+    'comments': (Comment, ['id', 'post', 'owner', 'text', 'created_at', 'status']),
+}
+
+
+def guess_format(path: str, default: str = 'ndjson') -> str:
+    return 'csv' if path.lower().endswith('.csv') else default
+
+
+def read_records(stream, fmt: str):
+    # NDJSON lines are yielded unparsed: clean_record() parses them, so a malformed line
+    # is skipped like any other invalid record instead of aborting the import
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield line
+
+
+def write_records(stream, fmt: str, fields: list, rows):
+    """ Writes dict rows to the stream, returns the number of rows """
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=fields)
+        writer.writeheader()
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+        return count
+    for count, row in enumerate(rows, 1):
+        stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return count
+
+
+def _optional_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+def clean_record(kind: str, record: dict, keep_ids: bool) -> dict:
+    """ Returns model field values of a record (raises ValueError/KeyError/TypeError on invalid ones) """
+    if isinstance(record, str):
+        record = json.loads(record)  # JSONDecodeError is a ValueError
+    text = record['text']
+    if not text:
+        raise ValueError('empty text')
+    created_at = record.get('created_at')
+    values = {
+        'owner_id': _optional_int(record.get('owner')),
+        'text': text,
+        'created_at': parse_datetime(created_at) if created_at else timezone.now(),
+        'status': record.get('status') or None,
+    }
+    if values['created_at'] is None:
+        raise ValueError(f'invalid created_at {created_at!r}')
+    if timezone.is_naive(values['created_at']):
+        values['created_at'] = timezone.make_aware(values['created_at'])
+    if values['status'] is not None and values['status'] not in ModerationStatus.values:
+        raise ValueError(f'invalid status {values["status"]!r}')
+    if kind == 'comments':
+        values['post_id'] = int(record['post'])
+    if keep_ids:
+        values['id'] = int(record['id'])
+    return values
+
+
+def _existing_ids(model, ids: set, using: str) -> set:
+    return set(model.objects.using(using).filter(id__in=ids).values_list('id', flat=True)) if ids else set()
+
+
+def drop_unresolvable(kind: str, batch: list, keep_ids: bool, using: str = 'default') -> list:
+    """ Returns the rows of a cleaned batch that can be inserted
+
+    Rows referencing a missing owner/post, or (with keep_ids) reusing an existing or earlier id
+    of the batch, would fail the whole batch with an IntegrityError, so they are dropped here
+    with one lookup per referenced table.
+    """
+    model, _ = FIELDS[kind]
+    owners = _existing_ids(User, {row['owner_id'] for row in batch if row['owner_id'] is not None}, using)
+    posts = _existing_ids(Post, {row['post_id'] for row in batch}, using) if kind == 'comments' else None
+    taken = _existing_ids(model, {row['id'] for row in batch}, using) if keep_ids else set()
+
+    rows = []
+    for row in batch:
+        if row['owner_id'] is not None and row['owner_id'] not in owners:
+            continue
+        if posts is not None and row['post_id'] not in posts:
+            continue
+        if keep_ids:
+            if row['id'] in taken:
+                continue
+            taken.add(row['id'])
+        rows.append(row)
+    return rows
+
+
+def _copy_rows(connection, model, columns: list, rows: list):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    table = connection.ops.quote_name(model._meta.db_table)
+    column_list = ', '.join(connection.ops.quote_name(column) for column in columns)
+    with connection.cursor() as cursor:
+        # empty unquoted csv fields are NULL
+        cursor.copy_expert(f'COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def import_records(kind: str, records, batch_size: int = 5000, moderate: bool = True, keep_ids: bool = False,
+                   use_copy: bool = True, using: str = 'default') -> dict:
+    """ Imports records of `kind` ('posts' or 'comments') in batches
+
+    Invalid records (malformed lines, missing or ill-typed fields, unknown owner/post ids,
+    ids already taken with keep_ids) are counted and skipped.
+
+    Args:
+        records: iterable of dicts (see FIELDS) or NDJSON lines, e.g. from read_records()
+        moderate (bool): classify texts (one batched call per batch) and set approved/rejected,
+            otherwise the record's status (default approved) is kept
+        keep_ids (bool): insert records' ids (and reset the id sequence afterwards)
+        use_copy (bool): use COPY instead of bulk_create on PostgreSQL
+
+    Returns:
+        Counts of imported, rejected (by moderation) and skipped (invalid) records, and with
+        moderate the verdict cache hits/misses of the import
+    """
+    model, _ = FIELDS[kind]
+    connection = connections[using]
+    use_copy = use_copy and connection.vendor == 'postgresql'
+    stats = {'imported': 0, 'rejected': 0, 'skipped': 0}
+    cache_stats = verdict_cache.stats()
+    post_ids = set()
+    records = iter(records)
+
+    try:
+        while True:
+            chunk = list(islice(records, batch_size))
+            if not chunk:
+                break
+            batch = []
+            for record in chunk:
+                try:
+                    batch.append(clean_record(kind, record, keep_ids))
+                except (KeyError, TypeError, ValueError):
+                    stats['skipped'] += 1
+            valid = drop_unresolvable(kind, batch, keep_ids, using)
+            stats['skipped'] += len(batch) - len(valid)
+            batch = valid
+            if not batch:
+                continue
+
+            if moderate:
+                verdicts = check_many_for_obscence([row['text'] for row in batch])
+                for row, clean in zip(batch, verdicts):
+                    row['status'] = ModerationStatus.APPROVED if clean else ModerationStatus.REJECTED
+            for row in batch:
+                row['status'] = row['status'] or ModerationStatus.APPROVED
+                stats['rejected'] += row['status'] == ModerationStatus.REJECTED
+
+            with transaction.atomic(using=using):
+                if use_copy:
+                    _copy_rows(connection, model, list(batch[0]), batch)
+                else:
+                    # rows carry the records' created_at (clean_record), as with COPY
+                    model.objects.using(using).bulk_create([model(**row) for row in batch], batch_size=batch_size)
+            stats['imported'] += len(batch)
+            if kind == 'comments':
+                post_ids.update(row['post_id'] for row in batch)
+    finally:
+        # batches committed before an error stay imported, so these run in any case
+        if keep_ids:
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                    cursor.execute(sql)
+
+        # bulk writes skip post_save, so counters and cached list pages are updated here
+        if kind == 'comments':
+            reconcile_comment_counters(batch_size=batch_size, post_ids=post_ids)
+            bump_generation('comments', 'posts', *[f'post_{post_id}' for post_id in post_ids])
+        else:
+            bump_generation('posts')
+    if moderate:
+        # this process classified the texts, so its counters are the import's
+        after = verdict_cache.stats()
+        stats['verdict_cache_hits'] = sum(after[name] - cache_stats[name] for name in ('local_hits', 'shared_hits'))
+        stats['verdict_cache_misses'] = after['misses'] - cache_stats['misses']
+    return stats
+
+
+def export_rows(kind: str, status: str = None, batch_size: int = 5000, using: str = 'default'):
+    """ Yields records of `kind` ordered by id, read through a server-side cursor (constant memory) """
+    model, fields = FIELDS[kind]
+    columns = ['owner_id' if field == 'owner' else 'post_id' if field == 'post' else field for field in fields]
+    queryset = model.objects.using(using).order_by('id')
+    if status:
+        queryset = queryset.filter(status=status)
+    for values in queryset.values_list(*columns).iterator(chunk_size=batch_size):
+        row = dict(zip(fields, values))
+        row['created_at'] = row['created_at'].isoformat()
+        yield row
@@ -1,51 +1,63 @@
 import json
 from djangochannelsrestframework.generics import GenericAsyncAPIConsumer
 from djangochannelsrestframework.observer.generics import (ObserverModelInstanceMixin, action)
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from accounts.authentication import CachedJWTAuthentication
+from .backpressure import BackpressureMixin
+from .broadcast import BroadcastGroupsMixin
 
 from .models import Post
 from .serializers import PostSerializer
-from .tasks import get_posts_task
+from .queries import aget_posts_page, aget_posts_after, approved_posts
+from .page_cache import aget_or_build
 
-class PostConsumer(ObserverModelInstanceMixin, GenericAsyncAPIConsumer):
+class PostConsumer(BackpressureMixin, BroadcastGroupsMixin, ObserverModelInstanceMixin, GenericAsyncAPIConsumer):
     
     serializer_class = PostSerializer
-    authentication_classes = (JWTAuthentication, )
+    authentication_classes = (CachedJWTAuthentication, )
+    # instances clients can subscribe to (subscribe_instance)
+    queryset = approved_posts()
     
     #default action to connect websocket
     async def connect(self):
         
-        await self.channel_layer.group_add(
-            'posts_group',
-            self.channel_name
-        )
+        await self.broadcast_group_add('posts_group')
         await self.accept()
         
     
-    # action for load posts
+    # action for load posts (pass `cursor` instead of `page_num` for keyset pagination)
     @action()
-    async def get_posts(self, page_num: int, **kwargs):
-        posts = get_posts_task.apply_async(args=[page_num]) # celery task to load data from db
+    async def get_posts(self, page_num: int = None, cursor: str = None, **kwargs):
+        if page_num is None:
+            posts, next_cursor = await aget_or_build(['posts'], 'feed_after', str(cursor), lambda: aget_posts_after(cursor))
+            return await self.send(text_data=json.dumps({
+                'event_type': 'display_post',
+                'post': posts,
+                'next_cursor': next_cursor
+            }))
+        
+        # async orm query (doesn't block the event loop), cached until the next post/comment write
+        posts = await aget_or_build(['posts'], 'feed_page', str(page_num), lambda: aget_posts_page(page_num))
 
         return await self.send(text_data=json.dumps({
             'event_type': 'display_post',
-            'post': posts.get()
+            'post': posts
         }))
         
-    # create post function (not @action because of api endpoint)
+    # create post function (not @action because of api endpoint), the frame comes pre-encoded (posts.broadcast)
     async def add_post(self, event: dict):
-        post = event['post']
-        await self.send(text_data=json.dumps({
-            'event_type': 'display_post',
-            'post': post
-        }))
+        await self.enqueue(event['text'])
+    
+    # new posts coalesced by the broadcaster (BROADCAST_COALESCE_MS), oldest first
+    async def add_post_batch(self, event: dict):
+        await self.enqueue(event['text'])
+    
+    # moderation verdict for a post created in async mode
+    async def post_verdict(self, event: dict):
+        await self.enqueue(event['text'])
     
     # action for close websocket connection
     @action()
     async def logout(self, **kwargs):
-        await self.channel_layer.group_discard(
-            'posts_group',
-            self.channel_name
-        )
+        await self.broadcast_group_discard('posts_group')
         await self.close(1000)
     
\ No newline at end of file
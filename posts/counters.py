@@ -0,0 +1,78 @@
+from django.db.models import Count, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from comments.models import Comment
+from .models import Post, ModerationStatus
+from .page_cache import bump_generation_on_commit
+"""
+Denormalized comment counters of posts (Post.comment_count, Post.last_comment_at)
+
+Only approved comments count. Every change is a single UPDATE computed by the database
+(F() expressions / subqueries), so concurrent writers never overwrite each other's counts.
+Callers run these in the transaction that approves or deletes the comment; writes that
+bypass them (admin, raw queryset deletes) are fixed by `manage.py reconcile_comment_counters`.
+Count changes invalidate the cached post list pages once the transaction commits.
+"""
+
+
+def _approved_comments():
+    return Comment.objects.filter(post=OuterRef('pk'), status=ModerationStatus.APPROVED).order_by().values('post')
+
+
+def _last_comment_at():
+    return Subquery(_approved_comments().annotate(last=Max('created_at')).values('last'))
+
+
+def comment_added(post_id: int, created_at):
+    """ Counts an approved comment (just created, approved by moderation or moved to the post) """
+    # NULL-safe max: Greatest() with a NULL argument is NULL on some backends
+    Post.objects.filter(id=post_id).update(
+        comment_count=F('comment_count') + 1,
+        last_comment_at=Greatest(Coalesce('last_comment_at', Value(created_at)), Value(created_at)),
+    )
+    bump_generation_on_commit('posts')
+
+
+def comment_removed(post_id: int):
+    """ Uncounts an approved comment (deleted or moved to another post) """
+    if Post.objects.filter(id=post_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1,
+        last_comment_at=_last_comment_at(),
+    ):
+        bump_generation_on_commit('posts')
+
+
+def reconcile_comment_counters(batch_size: int = 1000, post_ids=None) -> int:
+    """ Recomputes the counters of posts whose stored values drifted from their comments
+
+    Posts are checked in id batches; drifted ones are recomputed by one UPDATE with
+    correlated subqueries, which stays correct under concurrent comment writes.
+
+    Returns:
+        Number of fixed posts
+    """
+    fixed = 0
+    queryset = Post.objects.order_by('id')
+    if post_ids is not None:
+        queryset = queryset.filter(id__in=post_ids)
+    last_id = 0
+    while True:
+        posts = list(queryset.filter(id__gt=last_id).values_list('id', 'comment_count', 'last_comment_at')[:batch_size])
+        if not posts:
+            if fixed:
+                bump_generation_on_commit('posts')
+            return fixed
+        last_id = posts[-1][0]
+
+        actual = {
+            row['post']: (row['count'], row['last'])
+            for row in Comment.objects.filter(post_id__in=[post[0] for post in posts], status=ModerationStatus.APPROVED)
+            .order_by().values('post').annotate(count=Count('id'), last=Max('created_at'))
+        }
+        drifted = [post_id for post_id, count, last in posts if actual.get(post_id, (0, None)) != (count, last)]
+        if drifted:
+            Post.objects.filter(id__in=drifted).update(
+                comment_count=Coalesce(Subquery(_approved_comments().annotate(count=Count('id')).values('count')), 0),
+                last_comment_at=_last_comment_at(),
+            )
+            fixed += len(drifted)
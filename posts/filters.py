@@ -1,4 +1,6 @@
 from django_filters import FilterSet, DateFilter
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from .models import Post
 
 class PostFilter(FilterSet):
@@ -9,4 +11,17 @@ class PostFilter(FilterSet):
         fields = {'text': ['icontains', 'exact'],
                   'owner': ['exact'],
                   }
-        extra_fields = ['date_from', 'date_to']
\ No newline at end of file
+        extra_fields = ['date_from', 'date_to']
+
+
+# ?ordering= with id as tie-breaker, so pages stay stable for equal counts/dates
+class StableOrderingFilter(OrderingFilter):
+    def get_ordering(self, request, queryset, view):
+        # keyset pages (?cursor=) are always ordered by created_at
+        cursor_param = getattr(view.paginator, 'cursor_query_param', None)
+        if cursor_param in request.query_params and self.ordering_param in request.query_params:
+            raise ValidationError({self.ordering_param: f'Cannot be combined with ?{cursor_param}=.'})
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering or ordering[-1].lstrip('-') in ('id', 'pk'):
+            return ordering
+        return list(ordering) + ['-id' if ordering[-1].startswith('-') else 'id']
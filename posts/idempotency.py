@@ -0,0 +1,179 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from celery_app import app
+from .models import IdempotencyRecord
+"""
+Idempotency-Key support for the create endpoints
+
+The first request with a key claims it (unique row per owner, endpoint and key) and stores its
+response when done. Retries with the same key and body get the stored response back without
+running the classifier or touching posts/comments; retries arriving while the original request
+is still waiting on its celery task wait on the same task instead of starting another one.
+Records are read through the cache, the database row is the source of truth. A claim that
+stored no response within IDEMPOTENCY_LEASE seconds (the request's process died) is taken
+over by the next retry.
+"""
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+class IdempotencyConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still in progress, retry later.'
+    default_code = 'idempotency_conflict'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used with a different request body.'
+    default_code = 'idempotency_key_reused'
+
+
+def request_hash(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _cache_key(owner_id: int, endpoint: str, key: str) -> str:
+    return f'idempotency:{owner_id}:{endpoint}:{hashlib.sha1(key.encode()).hexdigest()}'
+
+
+def _as_entry(record: IdempotencyRecord) -> dict:
+    return {
+        'id': record.id,
+        'request_hash': record.request_hash,
+        'task_id': record.task_id,
+        'status': record.response_status,
+        'body': record.response_body,
+        'created_at': record.created_at.timestamp(),
+    }
+
+
+def _lease_expired(entry: dict) -> bool:
+    created_at = entry.get('created_at')  # missing in entries cached by older versions
+    return entry['status'] is None and created_at is not None and created_at < timezone.now().timestamp() - settings.IDEMPOTENCY_LEASE
+
+
+class IdempotentCreateMixin:
+    """ Create view mixin: requests with an Idempotency-Key header are executed at most once
+
+    Views report the celery task they wait on with `task_started(task)` and build responses
+    from task results with `response_for(result)`, which is also used for retries that waited
+    on the original task.
+    """
+    idempotency_endpoint = None  # defaults to the view class name
+    _idempotency_claim = None
+
+    def response_for(self, response_data: dict, headers: dict = None) -> Response:
+        if response_data.get('status') == 'success':
+            return Response(data=response_data, status=status.HTTP_201_CREATED, headers=headers)
+        elif response_data.get('status') == 'pending':
+            return Response(data=response_data, status=status.HTTP_202_ACCEPTED, headers=headers)
+        else:
+            return Response(data=response_data, status=status.HTTP_400_BAD_REQUEST, headers=headers)
+
+    def task_started(self, task):
+        claim = self._idempotency_claim
+        # no row: the claim outlived its lease and was taken over
+        if claim is not None and IdempotencyRecord.objects.filter(id=claim['entry']['id']).update(task_id=task.id):
+            claim['entry']['task_id'] = task.id
+            cache.set(claim['cache_key'], claim['entry'], settings.IDEMPOTENCY_TTL)
+
+    # wraps post() rather than create(), which the views override
+    def post(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return super().post(request, *args, **kwargs)
+        if not key or len(key) > 255:
+            raise ValidationError({IDEMPOTENCY_HEADER: 'Must be 1 to 255 characters long.'})
+
+        endpoint = self.idempotency_endpoint or self.__class__.__name__
+        cache_key = _cache_key(request.user.id, endpoint, key)
+        body_hash = request_hash(request.data)
+
+        entry = cache.get(cache_key)
+        if entry is None or _lease_expired(entry):
+            entry = self._claim(request.user, endpoint, key, body_hash, cache_key)
+        if entry is not None:
+            return self._replay(entry, body_hash)
+
+        try:
+            response = super().post(request, *args, **kwargs)
+        except Exception:
+            # nothing was stored (invalid body, task error...): the key can be retried
+            self._release()
+            raise
+        self._store(response)
+        return response
+
+    def _claim(self, owner, endpoint: str, key: str, body_hash: str, cache_key: str):
+        """ Claims the key for this request (returns None) or returns the existing record's entry """
+        now = timezone.now()
+        IdempotencyRecord.objects.filter(owner=owner, endpoint=endpoint, key=key).filter(
+            Q(created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_TTL))
+            | Q(response_status__isnull=True, created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_LEASE))
+        ).delete()
+        try:
+            # savepoint: a lost race must not break an enclosing transaction
+            with transaction.atomic():
+                record = IdempotencyRecord.objects.create(owner=owner, endpoint=endpoint, key=key, request_hash=body_hash)
+        except IntegrityError:
+            record = IdempotencyRecord.objects.filter(owner=owner, endpoint=endpoint, key=key).first()
+            if record is None:
+                raise IdempotencyConflict()
+            entry = _as_entry(record)
+            cache.set(cache_key, entry, settings.IDEMPOTENCY_TTL)
+            return entry
+
+        self._idempotency_claim = {'entry': _as_entry(record), 'cache_key': cache_key}
+        cache.set(cache_key, self._idempotency_claim['entry'], settings.IDEMPOTENCY_TTL)
+        return None
+
+    def _replay(self, entry: dict, body_hash: str) -> Response:
+        if entry['request_hash'] != body_hash:
+            raise IdempotencyKeyReused()
+        if entry['status'] is not None:
+            return Response(data=entry['body'], status=entry['status'], headers={REPLAYED_HEADER: 'true'})
+        if entry['task_id'] is None:
+            raise IdempotencyConflict()
+
+        # in flight: wait on the original request's task instead of classifying again
+        try:
+            result = app.AsyncResult(entry['task_id']).get(timeout=settings.IDEMPOTENCY_WAIT)
+        except CeleryTimeoutError:
+            raise IdempotencyConflict()
+        # the stored response if there is one: in ASYNC_CREATE mode the task is the moderation
+        # that follows the (already sent) 202 response, its result is not the response
+        stored = IdempotencyRecord.objects.filter(id=entry['id'], response_status__isnull=False).first()
+        if stored is not None:
+            return Response(data=stored.response_body, status=stored.response_status, headers={REPLAYED_HEADER: 'true'})
+        return self.response_for(result, headers={REPLAYED_HEADER: 'true'})
+
+    def _store(self, response: Response):
+        claim = self._idempotency_claim
+        if response.status_code >= 500:
+            self._release()
+            return
+        claim['entry'].update(status=response.status_code, body=response.data)
+        if IdempotencyRecord.objects.filter(id=claim['entry']['id']).update(response_status=response.status_code, response_body=response.data):
+            cache.set(claim['cache_key'], claim['entry'], settings.IDEMPOTENCY_TTL)
+
+    def _release(self):
+        claim = self._idempotency_claim
+        if claim is not None:
+            deleted, _ = IdempotencyRecord.objects.filter(id=claim['entry']['id']).delete()
+            if deleted:
+                cache.delete(claim['cache_key'])
+            self._idempotency_claim = None
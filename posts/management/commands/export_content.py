@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.bulk import FIELDS, FORMATS, export_rows, guess_format, write_records
+from posts.models import ModerationStatus
+
+
+class Command(BaseCommand):
+    help = 'Exports posts or comments to an NDJSON or CSV file, streaming rows in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(FIELDS))
+        parser.add_argument('path', help="output file, '-' for stdout")
+        parser.add_argument('--format', choices=FORMATS, help='defaults to csv for *.csv files, ndjson otherwise')
+        parser.add_argument('--status', choices=ModerationStatus.values, help='export only rows with this moderation status')
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows fetched per round trip')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+        to_stdout = options['path'] == '-'
+        try:
+            stream = self.stdout if to_stdout else open(options['path'], 'w', newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+
+        _, fields = FIELDS[options['kind']]
+        rows = export_rows(options['kind'], status=options['status'], batch_size=options['batch_size'])
+        try:
+            count = write_records(stream, fmt, fields, rows)
+        finally:
+            if not to_stdout:
+                stream.close()
+        if not to_stdout:
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} {options['kind']} to {options['path']}."))
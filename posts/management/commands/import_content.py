@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.bulk import FIELDS, FORMATS, guess_format, import_records, read_records
+
+
+class Command(BaseCommand):
+    help = 'Imports posts or comments from an NDJSON or CSV file (batched moderation, bulk inserts / COPY)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(FIELDS))
+        parser.add_argument('path', help="input file, '-' for stdin")
+        parser.add_argument('--format', choices=FORMATS, help='defaults to csv for *.csv files, ndjson otherwise')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--skip-moderation', action='store_true', help="keep records' status (default approved) instead of classifying texts")
+        parser.add_argument('--keep-ids', action='store_true', help="insert records' ids (e.g. to import comments of exported posts)")
+        parser.add_argument('--no-copy', action='store_true', help='use bulk_create on PostgreSQL too')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+        try:
+            stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+
+        with stream:
+            stats = import_records(
+                options['kind'],
+                read_records(stream, fmt),
+                batch_size=options['batch_size'],
+                moderate=not options['skip_moderation'],
+                keep_ids=options['keep_ids'],
+                use_copy=not options['no_copy'],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['imported']} {options['kind']} ({stats['rejected']} rejected by moderation), "
+            f"skipped {stats['skipped']} invalid records."
+        ))
+        if 'verdict_cache_hits' in stats:
+            self.stdout.write(f"Verdict cache: {stats['verdict_cache_hits']} hits, {stats['verdict_cache_misses']} misses.")
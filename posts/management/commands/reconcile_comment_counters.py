@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile_comment_counters
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Post.comment_count and Post.last_comment_at where they drifted from the approved comments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='posts checked per batch')
+        parser.add_argument('--post', type=int, action='append', dest='post_ids', help='only this post (repeatable)')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_comment_counters(batch_size=options['batch_size'], post_ids=options['post_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Fixed comment counters of {fixed} posts.'))
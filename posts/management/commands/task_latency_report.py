@@ -0,0 +1,83 @@
+import json
+import math
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from config.task_metrics import read_records
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: list, p: float) -> float:
+    # nearest-rank on sorted values
+    index = max(0, min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(records: list) -> dict:
+    """ Per task: count, states, summed counters and p50/p95/p99 in ms of the total and of every stage """
+    tasks = {}
+    for record in records:
+        entry = tasks.setdefault(record['task'], {'states': {}, 'total': [], 'stages': {}, 'counters': {}})
+        entry['states'][record['state']] = entry['states'].get(record['state'], 0) + 1
+        for name, value in record.get('counters', {}).items():
+            entry['counters'][name] = entry['counters'].get(name, 0) + value
+        entry['total'].append(record['seconds'])
+        for name, seconds in record['stages'].items():
+            entry['stages'].setdefault(name, []).append(seconds)
+
+    def percentiles(values):
+        values = sorted(values)
+        return {f'p{p}': round(percentile(values, p) * 1000, 3) for p in PERCENTILES}
+
+    return {
+        task: {
+            'count': len(entry['total']),
+            'states': entry['states'],
+            'counters': dict(sorted(entry['counters'].items())),
+            'total': percentiles(entry['total']),
+            # a stage missing from some records (e.g. no queue wait in eager mode) counts only where present
+            'stages': {name: {'count': len(values), **percentiles(values)} for name, values in sorted(entry['stages'].items())},
+        }
+        for task, entry in sorted(tasks.items())
+    }
+
+
+class Command(BaseCommand):
+    help = 'Reports p50/p95/p99 latency per celery task and per stage from TASK_METRICS_FILE records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='NDJSON records file (default: settings.TASK_METRICS_FILE)')
+        parser.add_argument('--task', help='only this task, e.g. posts.tasks.create_post')
+        parser.add_argument('--since', type=float, help='only tasks finished in the last N minutes')
+        parser.add_argument('--json', action='store_true', help='print the report as JSON')
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.TASK_METRICS_FILE
+        if not path:
+            raise CommandError('No records file: pass --file or set TASK_METRICS_FILE (workers only record tasks when it is set).')
+        since = time.time() - options['since'] * 60 if options['since'] else None
+        try:
+            report = summarize(list(read_records(path, task=options['task'], since=since)))
+        except OSError as e:
+            raise CommandError(e)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if not report:
+            self.stdout.write('No task records.')
+            return
+        header = f"{'':<14}{'count':>8}" + ''.join(f'{f"p{p} ms":>12}' for p in PERCENTILES)
+        for task, entry in report.items():
+            states = ', '.join(f'{state}: {count}' for state, count in sorted(entry['states'].items()))
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{task} ({states})'))
+            self.stdout.write(header)
+            rows = [('total', {'count': entry['count'], **entry['total']})] + list(entry['stages'].items())
+            for name, values in rows:
+                self.stdout.write(f"{name:<14}{values['count']:>8}" + ''.join(f"{values[f'p{p}']:>12.3f}" for p in PERCENTILES))
+            if entry['counters']:
+                self.stdout.write(', '.join(f'{name}: {value}' for name, value in entry['counters'].items()))
+            self.stdout.write('')
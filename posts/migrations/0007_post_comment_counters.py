@@ -0,0 +1,48 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:52
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# counters of existing posts, one UPDATE with correlated subqueries
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('comments', 'Comment')
+    approved = Comment.objects.filter(post=OuterRef('pk'), status='approved').order_by().values('post')
+    Post.objects.update(
+        comment_count=Coalesce(Subquery(approved.annotate(count=Count('id')).values('count'), output_field=IntegerField()), 0),
+        last_comment_at=Subquery(approved.annotate(last=Max('created_at')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_idempotencyrecord'),
+        ('comments', '0004_comment_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', 'comment_count', 'id'], name='post_comment_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['status', 'last_comment_at', 'id'], name='post_last_comment_idx'),
+        ),
+    ]
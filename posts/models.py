@@ -1,11 +1,62 @@
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from accounts.models import User
 
+
+class ModerationStatus(models.TextChoices):
+    PENDING = 'pending', 'Pending moderation'
+    APPROVED = 'approved', 'Approved'
+    REJECTED = 'rejected', 'Rejected'
+
+
 # Create your models here.
 class Post(models.Model):
     owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='posts')
     text = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # a default rather than auto_now_add, so imported rows (posts.bulk) keep their own timestamps
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    status = models.CharField(max_length=16, choices=ModerationStatus.choices, default=ModerationStatus.APPROVED)
+    # maintained by a database trigger on PostgreSQL (see posts.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # approved comments, kept up to date with F() updates (see posts.counters)
+    # db_default: raw inserts (COPY in posts.bulk) don't list the column
+    comment_count = models.PositiveIntegerField(default=0, db_default=0, editable=False)
+    last_comment_at = models.DateTimeField(null=True, blank=True, editable=False)
     
+    class Meta:
+        indexes = [
+            # feed, list & date range queries: status = approved ORDER BY created_at, id
+            models.Index(fields=['status', 'created_at', 'id'], name='post_feed_idx'),
+            # ?owner= filter
+            models.Index(fields=['owner', 'status', 'created_at'], name='post_owner_feed_idx'),
+            # ?ordering=-comment_count / -last_comment_at
+            models.Index(fields=['status', 'comment_count', 'id'], name='post_comment_count_idx'),
+            models.Index(fields=['status', 'last_comment_at', 'id'], name='post_last_comment_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.owner.id} - {self.id}'
+
+
+# stored outcome of a create request sent with an Idempotency-Key (see posts.idempotency)
+class IdempotencyRecord(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_records')
+    endpoint = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    # celery task the request is waiting on, so retries can wait on it too
+    task_id = models.CharField(max_length=255, null=True, blank=True)
+    # null while the request is in flight
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'endpoint', 'key'], name='idempotency_key_unique'),
+        ]
+
     def __str__(self):
-        return f'{self.owner.id} - {self.id}'
\ No newline at end of file
+        return f'{self.owner_id} - {self.endpoint} - {self.key}'
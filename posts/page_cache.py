@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework.response import Response
+
+from comments.models import Comment
+from config.metrics import stage, staged
+from .models import Post
+"""
+Versioned cache of post & comment list pages
+
+Every cached page key contains the current generation of its scopes ('posts', 'comments',
+'post_<id>'). Writes bump the generation counters, so invalidation is O(1) and covers every
+page of the scope; old pages simply stop being read and expire by TTL.
+"""
+
+_stats = {'hits': 0, 'misses': 0, 'waits': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def page_cache_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+def _generation_key(scope: str) -> str:
+    return f'pages:gen:{scope}'
+
+
+def _initial_generation() -> int:
+    # a lost counter restarts above every value it could have reached, never reusing old keys
+    return time.time_ns() // 1000
+
+
+def bump_generation(*scopes: str):
+    for scope in scopes:
+        try:
+            cache.incr(_generation_key(scope))
+        except ValueError:
+            cache.add(_generation_key(scope), _initial_generation(), None)
+
+
+def bump_generation_on_commit(*scopes: str):
+    """ Bumps the generations once the current transaction commits (immediately in autocommit)
+
+    Bumping inside the writer's transaction would let a concurrent reader rebuild the page from
+    pre-commit rows and store it under the new generation, serving it stale for PAGE_CACHE_TTL.
+    """
+    transaction.on_commit(lambda: bump_generation(*scopes))
+
+
+def get_generation(scope: str) -> int:
+    """ Current generation of `scope`, for other per-scope caches (e.g. posts.search) """
+    return _missing_generations([scope], {})[_generation_key(scope)]
+
+
+def _page_key(name: str, scopes: list, generations: dict, params: str) -> str:
+    versions = ':'.join(f'{scope}={generations[_generation_key(scope)]}' for scope in scopes)
+    return f'pages:{name}:{versions}:{hashlib.sha1(params.encode()).hexdigest()}'
+
+
+def _missing_generations(scopes: list, generations: dict) -> dict:
+    for scope in scopes:
+        key = _generation_key(scope)
+        if key not in generations:
+            cache.add(key, _initial_generation(), None)
+            generations[key] = cache.get(key)
+    return generations
+
+
+@staged('cache')
+def get_or_build(scopes: list, name: str, params: str, build):
+    """ Returns the cached page or builds it with `build()`
+
+    Stampede protection: only the caller holding the lock rebuilds a missing page, the others
+    wait (up to PAGE_CACHE_WAIT seconds) for it to appear before building it themselves.
+    """
+    build = staged('serialize')(build)
+    generations = cache.get_many([_generation_key(scope) for scope in scopes])
+    key = _page_key(name, scopes, _missing_generations(scopes, generations), params)
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value
+
+    _count('misses')
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+        _count('waits')
+        deadline = time.monotonic() + settings.PAGE_CACHE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        return build()
+
+    try:
+        value = build()
+        cache.set(key, value, settings.PAGE_CACHE_TTL)
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+@staged('cache')
+async def aget_or_build(scopes: list, name: str, params: str, build):
+    """ Same as get_or_build for async callers; `build` is a coroutine function """
+    async def staged_build():
+        with stage('serialize'):
+            return await build()
+    generations = await cache.aget_many([_generation_key(scope) for scope in scopes])
+    if len(generations) < len(scopes):
+        generations = await asyncio.to_thread(_missing_generations, scopes, generations)
+    key = _page_key(name, scopes, generations, params)
+    value = await cache.aget(key)
+    if value is not None:
+        _count('hits')
+        return value
+
+    _count('misses')
+    lock_key = f'{key}:lock'
+    if not await cache.aadd(lock_key, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+        _count('waits')
+        deadline = time.monotonic() + settings.PAGE_CACHE_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            value = await cache.aget(key)
+            if value is not None:
+                return value
+        return await staged_build()
+
+    try:
+        value = await staged_build()
+        await cache.aset(key, value, settings.PAGE_CACHE_TTL)
+    finally:
+        await cache.adelete(lock_key)
+    return value
+
+
+class CachedListMixin:
+    """ Caches list responses of a ListAPIView by full URL under the view's generation scopes """
+    cache_scopes = ('posts', )
+
+    def get_cache_scopes(self) -> list:
+        return list(self.cache_scopes)
+
+    def list(self, request, *args, **kwargs):
+        data = get_or_build(
+            self.get_cache_scopes(),
+            self.__class__.__name__,
+            request.build_absolute_uri(),
+            lambda: super(CachedListMixin, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
+
+
+# invalidation: post lists show the denormalized comment counters, which bump 'posts' themselves
+# (posts.counters) only when a count changes, so plain comment writes leave the feed cached
+def _post_changed(sender, instance, **kwargs):
+    bump_generation_on_commit('posts')
+
+
+def _comment_changed(sender, instance, **kwargs):
+    bump_generation_on_commit('comments', f'post_{instance.post_id}')
+
+
+def connect_signals():
+    post_save.connect(_post_changed, sender=Post, dispatch_uid='page_cache_post_saved')
+    post_delete.connect(_post_changed, sender=Post, dispatch_uid='page_cache_post_deleted')
+    post_save.connect(_comment_changed, sender=Comment, dispatch_uid='page_cache_comment_saved')
+    post_delete.connect(_comment_changed, sender=Comment, dispatch_uid='page_cache_comment_deleted')
@@ -1,5 +1,95 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class ItemPagination(PageNumberPagination):
-    page_size = 25 
-    page_size_query_param = 'page_size'  # /?page_size=xxx
\ No newline at end of file
+    page_size = 25
+    page_size_query_param = 'page_size'  # /?page_size=xxx
+
+
+# keyset (cursor) pagination on (created_at, id): every page costs one index range scan, no OFFSET
+def encode_cursor(obj) -> str:
+    raw = json.dumps([obj.created_at.isoformat(), obj.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError
+        return created_at, int(pk)
+    except (TypeError, ValueError):
+        raise NotFound('Invalid cursor.')
+
+
+def keyset_queryset(queryset, cursor: str = None, descending: bool = True):
+    if descending:
+        queryset = queryset.order_by('-created_at', '-id')
+    else:
+        queryset = queryset.order_by('created_at', 'id')
+    if not cursor:
+        return queryset
+
+    created_at, pk = decode_cursor(cursor)
+    # (created_at, id) < (cursor) written so that created_at alone bounds the index range
+    if descending:
+        return queryset.filter(Q(created_at__lte=created_at), Q(created_at__lt=created_at) | Q(id__lt=pk))
+    return queryset.filter(Q(created_at__gte=created_at), Q(created_at__gt=created_at) | Q(id__gt=pk))
+
+
+def keyset_page(queryset, cursor: str = None, page_size: int = 25, descending: bool = True) -> tuple:
+    """ Returns one page of objects and the cursor of the next page (None on the last page) """
+    items = list(keyset_queryset(queryset, cursor, descending)[:page_size + 1])
+    next_cursor = encode_cursor(items[page_size - 1]) if len(items) > page_size else None
+    return items[:page_size], next_cursor
+
+
+async def akeyset_page(queryset, cursor: str = None, page_size: int = 25, descending: bool = True) -> tuple:
+    items = [item async for item in keyset_queryset(queryset, cursor, descending)[:page_size + 1]]
+    next_cursor = encode_cursor(items[page_size - 1]) if len(items) > page_size else None
+    return items[:page_size], next_cursor
+
+
+class KeysetPagination(ItemPagination):
+    """ Page number pagination with an optional keyset mode
+
+    Requests with ?cursor= (empty for the first page) are paginated on (created_at, id)
+    and return `next_cursor` instead of page numbers. Requests without it keep ?page=N.
+    """
+    cursor_query_param = 'cursor'
+    descending = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        self.page, self.next_cursor = keyset_page(queryset, cursor, self.get_page_size(request), self.descending)
+        return self.page
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
@@ -1,8 +1,6 @@
 from rest_framework import permissions
-from django.shortcuts import get_object_or_404
-from accounts.models import User
 
 class IsOwner(permissions.BasePermission):
+    # compares ids, so neither the owner nor the request user is fetched again
     def has_object_permission(self, request, view, obj):
-        user = get_object_or_404(User, id=request.user.id)
-        return obj.owner == user
\ No newline at end of file
+        return obj.owner_id is not None and obj.owner_id == request.user.id
\ No newline at end of file
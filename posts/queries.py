@@ -0,0 +1,58 @@
+from .models import Post, ModerationStatus
+from .pagination import keyset_page, akeyset_page
+
+PAGE_SIZE = 25
+
+
+# shared base queryset for every post read path: owner is joined, comment counts are
+# stored on the post (Post.comment_count), so no per-row subquery is needed
+def post_queryset():
+    return Post.objects.select_related('owner').defer('search_vector')
+
+
+def approved_posts():
+    return post_queryset().filter(status=ModerationStatus.APPROVED)
+
+
+# approved posts, newest first
+def feed_queryset():
+    return approved_posts().order_by('-created_at', '-id')
+
+
+def page_bounds(page_num) -> tuple:
+    try:
+        page_num = max(int(page_num), 1)
+    except (TypeError, ValueError):
+        page_num = 1
+    start = (page_num - 1) * PAGE_SIZE
+    return start, start + PAGE_SIZE
+
+
+def serialize_feed_post(post: Post) -> dict:
+    return {
+        'id': post.id,
+        'username': post.owner.username if post.owner else None,
+        'text': post.text
+    }
+
+
+def get_posts_page(page_num: int) -> list:
+    start, end = page_bounds(page_num)
+    return [serialize_feed_post(post) for post in feed_queryset()[start:end]]
+
+
+# same as get_posts_page, but doesn't block the event loop (used by websocket consumers)
+async def aget_posts_page(page_num: int) -> list:
+    start, end = page_bounds(page_num)
+    return [serialize_feed_post(post) async for post in feed_queryset()[start:end]]
+
+
+# keyset pagination: the cursor of the last seen post replaces page_num
+def get_posts_after(cursor: str = None) -> tuple:
+    posts, next_cursor = keyset_page(feed_queryset(), cursor, PAGE_SIZE)
+    return [serialize_feed_post(post) for post in posts], next_cursor
+
+
+async def aget_posts_after(cursor: str = None) -> tuple:
+    posts, next_cursor = await akeyset_page(feed_queryset(), cursor, PAGE_SIZE)
+    return [serialize_feed_post(post) for post in posts], next_cursor
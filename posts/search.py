@@ -0,0 +1,158 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.signals import post_delete, post_save
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .page_cache import get_generation
+"""
+Full-text search for posts and comments
+
+On PostgreSQL `search_vector` (tsvector, GIN index) is maintained by a trigger on write
+and queried with websearch syntax; a pg_trgm index on `text` catches partial words.
+Other databases (SQLite test runs) use an in-process inverted index instead.
+"""
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower())
+
+
+class InvertedIndex:
+    """ In-process token -> {id: term frequency} index of a model's `text` field
+
+    Built lazily from the database on first search and updated by post_save/post_delete
+    signals of this process. Writes made elsewhere (celery workers, other web processes) or
+    that skip signals (bulk_create, update()) are picked up by a rebuild on the next search
+    once they bumped the page cache generation of `scope` (posts.page_cache).
+    """
+    def __init__(self, model, scope: str):
+        self.model = model
+        self.scope = scope
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        self._built = False
+        self._generation = None
+        self._lock = threading.RLock()
+
+    def rebuild(self):
+        with self._lock:
+            # read before the rows, so a write committed meanwhile triggers another rebuild
+            generation = get_generation(self.scope)
+            self._postings.clear()
+            self._documents.clear()
+            for pk, text in self.model._default_manager.values_list('id', 'text').iterator():
+                self._add(pk, text)
+            self._built = True
+            self._generation = generation
+
+    def _add(self, pk: int, text: str):
+        self._remove(pk)
+        tokens = tokenize(text)
+        self._documents[pk] = set(tokens)
+        for token in tokens:
+            self._postings[token][pk] = self._postings[token].get(pk, 0) + 1
+
+    def _remove(self, pk: int):
+        for token in self._documents.pop(pk, ()):
+            self._postings[token].pop(pk, None)
+            if not self._postings[token]:
+                del self._postings[token]
+
+    def add(self, pk: int, text: str):
+        with self._lock:
+            if self._built:
+                self._add(pk, text)
+
+    def remove(self, pk: int):
+        with self._lock:
+            if self._built:
+                self._remove(pk)
+
+    def search(self, query: str, limit: int = 1000) -> list:
+        """ Returns ids of documents containing every query token, best (tf-idf) first """
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+
+        with self._lock:
+            if not self._built or self._generation != get_generation(self.scope):
+                self.rebuild()
+            postings = [self._postings.get(token, {}) for token in tokens]
+            if not all(postings):
+                return []
+            total = len(self._documents)
+            matches = set.intersection(*(set(posting) for posting in postings))
+            scores = {
+                pk: sum(posting[pk] * math.log(1 + total / len(posting)) for posting in postings)
+                for pk in matches
+            }
+        return sorted(scores, key=lambda pk: (-scores[pk], -pk))[:limit]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+# page cache generation bumped by every write of the indexed model (see posts.page_cache)
+GENERATION_SCOPES = {'posts.Post': 'posts', 'comments.Comment': 'comments'}
+
+
+def get_inverted_index(model) -> InvertedIndex:
+    with _indexes_lock:
+        if model not in _indexes:
+            _indexes[model] = InvertedIndex(model, GENERATION_SCOPES[model._meta.label])
+            # receivers are bound to the indexed model only, so deletes of other models stay fast (no per-row signals)
+            post_save.connect(_update_inverted_index, sender=model, dispatch_uid=f'search_update_{model._meta.label}')
+            post_delete.connect(_remove_from_inverted_index, sender=model, dispatch_uid=f'search_remove_{model._meta.label}')
+        return _indexes[model]
+
+
+def _update_inverted_index(sender, instance, **kwargs):
+    if sender in _indexes:
+        _indexes[sender].add(instance.pk, instance.text)
+
+
+def _remove_from_inverted_index(sender, instance, **kwargs):
+    if sender in _indexes:
+        _indexes[sender].remove(instance.pk)
+
+
+def search(queryset, query: str):
+    """ Filters queryset (of a model with `text` & `search_vector`) by query, best match first """
+    if connections[queryset.db].vendor == 'postgresql':
+        search_query = SearchQuery(query, search_type='websearch', config=settings.SEARCH_CONFIG)
+        return queryset.annotate(
+            rank=SearchRank(F('search_vector'), search_query) + TrigramWordSimilarity(query, 'text')
+        ).filter(
+            # trigram fallback catches partial words (uses the gin_trgm_ops index)
+            Q(search_vector=search_query) | Q(text__trigram_word_similar=query)
+        ).order_by('-rank', '-created_at', '-id')
+
+    ids = get_inverted_index(queryset.model).search(query)
+    if not ids:
+        return queryset.none()
+    ranking = Case(*[When(pk=pk, then=Value(position)) for position, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).annotate(rank=ranking).order_by('rank')
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    # ?search=<query>
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        # search results are ordered by rank, keyset pages (?cursor=) by created_at
+        cursor_param = getattr(getattr(view, 'paginator', None), 'cursor_query_param', None)
+        if cursor_param in request.query_params:
+            raise ValidationError({self.search_param: f'Cannot be combined with ?{cursor_param}=.'})
+        return search(queryset, query)
@@ -7,6 +7,11 @@ class CreatePostSerializer(serializers.ModelSerializer):
         model = Post
         fields = ['text']
         
+class PostStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Post
+        fields = ['id', 'status']
+        
 class PostOwnerSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -17,4 +22,5 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        fields = ['id', 'owner', 'text', 'created_at']
\ No newline at end of file
+        fields = ['id', 'owner', 'text', 'created_at', 'comment_count', 'last_comment_at']
+        read_only_fields = ['comment_count', 'last_comment_at']
\ No newline at end of file
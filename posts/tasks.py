@@ -1,7 +1,9 @@
+from datetime import timedelta
+
 from celery_app import app
-from django.core.paginator import Paginator
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
 from django.http import Http404
 from django.db import transaction
 from rest_framework import status
@@ -10,27 +12,25 @@ from rest_framework.response import Response
 from accounts.models import User
 from .serializers import PostSerializer
 from posts.utils import check_for_obscence
-from .models import Post
+from .models import Post, ModerationStatus, IdempotencyRecord
+from .queries import get_posts_page, serialize_feed_post
+from .broadcast import broadcast_event, broadcast_frame
+from .page_cache import get_or_build, bump_generation_on_commit
 
 
 @app.task()
 def get_posts_task(page_num: int) -> list:
     try:
-        queryset = Post.objects.all().order_by('created_at')[::-1]
-        paginator = Paginator(queryset, 25)
-        result = paginator.get_page(page_num)
-        posts = []
-        for post in result:
-            posts.append({
-                'id': post.id,
-                'username': post.owner.username,
-                'text': post.text
-            })
-        return posts
+        return get_or_build(['posts'], 'feed_page', str(page_num), lambda: get_posts_page(page_num))
     except Exception as e:
         print(f"Error in get_posts task: {e}")
         
         
+# notify websocket users about new post (same item shape as feed pages, encoded once for every socket)
+def broadcast_post(post: Post):
+    broadcast_event('posts_group', 'add_post', 'display_post', 'post', serialize_feed_post(post))
+
+
 @app.task()
 @transaction.atomic
 def create_post(owner_id: int, post_data: dict, *args):
@@ -39,18 +39,45 @@ def create_post(owner_id: int, post_data: dict, *args):
         user = User.objects.get(id=owner_id)
         post = Post.objects.create(owner=user, **post_data)
         post_data = PostSerializer(post).data
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-                    'posts_group',
-                    {
-                        'type': 'add_post',
-                        'post': {
-                            'id': post.id,
-                            'username': post.owner.username,
-                            'text': post.text,
-                        }
-                    }
-                )
+        broadcast_post(post)
         return {'status':'success', 'detail': 'Post created successfully!', 'post': post_data}
     else:
-        return {'status': 'fail', 'detail': 'Your post is obscene. The post will not be created.'}
\ No newline at end of file
+        return {'status': 'fail', 'detail': 'Your post is obscene. The post will not be created.'}
+
+
+# celery task to moderate a post stored in "pending" state (async creation mode)
+@app.task()
+def moderate_post(post_id: int):
+    post = Post.objects.select_related('owner').filter(id=post_id, status=ModerationStatus.PENDING).first()
+    if post is None:
+        return {'status': 'fail', 'detail': 'Post is not pending moderation.'}
+
+    post.status = ModerationStatus.APPROVED if check_for_obscence(post.text) else ModerationStatus.REJECTED
+    with transaction.atomic():
+        # conditional update: a redelivered or duplicate task finds the post already moderated
+        # and must not publish it again (update() skips post_save, so pages are bumped here)
+        moderated = Post.objects.filter(id=post.id, status=ModerationStatus.PENDING).update(status=post.status)
+        if moderated:
+            bump_generation_on_commit('posts')
+    if not moderated:
+        return {'status': 'fail', 'detail': 'Post is not pending moderation.'}
+
+    if post.status == ModerationStatus.APPROVED:
+        broadcast_post(post)
+    broadcast_frame('posts_group', 'post_verdict', {
+        'event_type': 'post_verdict',
+        'verdict': {
+            'id': post.id,
+            'owner': post.owner_id,
+            'status': post.status,
+        }
+    })
+    return {'status': post.status, 'post_id': post.id}
+
+
+# periodic (celery beat) cleanup of stored Idempotency-Key responses past IDEMPOTENCY_TTL
+@app.task()
+def purge_idempotency_records() -> int:
+    expired_before = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_TTL)
+    deleted, _ = IdempotencyRecord.objects.filter(created_at__lt=expired_before).delete()
+    return deleted
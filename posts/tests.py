@@ -1,14 +1,68 @@
-from unittest.mock import patch
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch
+from django.core.cache import cache
+from django.db import connection
+import json
+from asgiref.testing import ApplicationCommunicator
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
 from accounts.models import User
-from .models import Post
+from .models import Post, ModerationStatus, IdempotencyRecord
+from .idempotency import request_hash
+from .bulk import clean_record, import_records
+from .counters import comment_added
+from comments.models import Comment
+from .tasks import moderate_post
+from .consumers import PostConsumer
+from .queries import get_posts_after, get_posts_page, feed_queryset
+from .pagination import keyset_queryset, encode_cursor
+from .filters import PostFilter
+from .search import get_inverted_index
+from . import page_cache
+from . import broadcast
+from .backpressure import BackpressureMixin, backpressure_stats
+import asyncio
+from channels.exceptions import ChannelFull
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from celery.signals import worker_process_shutdown
+from celery_app import app
+from .views import ListPostView
+from . import utils
+from config.metrics import Profile, ProfileSlot, bind_slot, unbind_slot
+from .utils import BatchClassifier, VerdictCache
 
 
 
+def websocket_scope(path: str) -> dict:
+    return {'type': 'websocket', 'path': path, 'headers': [], 'query_string': b'', 'subprotocols': []}
+
+
+class QueryPlanAssertions:
+    # checks EXPLAIN output: the query must use the index and must not sort rows itself
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # tiny test tables would always be seq scanned
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan)  # sqlite
+        self.assertNotRegex(plan, r'(?m)^\s*(->\s*)?(Incremental )?Sort\b')  # postgresql
+
+
 # Create your tests here.
 class CreatePostViewTests(APITestCase):
     def setUp(self):
@@ -43,6 +97,214 @@ class CreatePostViewTests(APITestCase):
         response = self.client.post(self.url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         
+class IdempotentCreatePostTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        # the create tasks run in-process, whatever the test settings say
+        self.addCleanup(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('create-post')
+
+    @patch('posts.tasks.check_for_obscence', return_value=True)
+    def test_retry_returns_stored_response(self, mock_check_obscence):
+        first = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        cache.clear()  # the database record is enough
+        with patch('posts.views.create_post.apply_async') as mock_create_post:
+            retry = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        mock_create_post.assert_not_called()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Post.objects.count(), 1)
+        mock_check_obscence.assert_called_once()
+
+        # other keys (and requests without one) are executed
+        self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-2')
+        self.client.post(self.url, {'text': 'Some normal text'}, format='json')
+        self.assertEqual(Post.objects.count(), 3)
+
+    @patch('posts.tasks.check_for_obscence', return_value=True)
+    def test_key_reused_with_another_body(self, mock_check_obscence):
+        self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        response = self.client.post(self.url, {'text': 'Other text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Post.objects.count(), 1)
+
+    @patch('posts.views.create_post.apply_async')
+    @patch('posts.idempotency.app.AsyncResult')
+    def test_in_flight_retry_waits_on_original_task(self, mock_async_result, mock_create_post):
+        IdempotencyRecord.objects.create(owner=self.user, endpoint='CreatePostView', key='key-1',
+                                         request_hash=request_hash({'text': 'Some normal text'}), task_id='task-1')
+        mock_async_result.return_value.get.return_value = {'status': 'success', 'detail': 'Post created successfully!', 'post': {'id': 1}}
+
+        response = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        mock_async_result.assert_called_once_with('task-1')
+        mock_create_post.assert_not_called()
+
+    def test_in_flight_retry_without_task_conflicts(self):
+        IdempotencyRecord.objects.create(owner=self.user, endpoint='CreatePostView', key='key-1',
+                                         request_hash=request_hash({'text': 'Some normal text'}))
+        response = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    @patch('posts.views.create_post.apply_async')
+    def test_task_id_is_recorded_and_failed_request_releases_key(self, mock_create_post):
+        mock_create_post.return_value.id = 'task-1'
+        mock_create_post.return_value.get.side_effect = RuntimeError('worker lost')
+        with self.assertRaises(RuntimeError):
+            self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+        mock_create_post.return_value.get.side_effect = None
+        mock_create_post.return_value.get.return_value = {'status': 'success', 'detail': 'Post created successfully!', 'post': {'id': 1}}
+        response = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        record = IdempotencyRecord.objects.get()
+        self.assertEqual((record.task_id, record.response_status), ('task-1', 201))
+
+    def test_invalid_request_is_not_stored(self):
+        response = self.client.post(self.url, {'text': ''}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+    @override_settings(IDEMPOTENCY_LEASE=60)
+    @patch('posts.views.create_post.apply_async')
+    def test_abandoned_claim_is_taken_over_after_lease(self, mock_create_post):
+        mock_create_post.return_value.id = 'task-2'
+        mock_create_post.return_value.get.return_value = {'status': 'success', 'detail': 'Post created successfully!', 'post': {'id': 1}}
+        # claimed by a request whose process died before storing a response (and cached as in flight)
+        with patch('posts.views.CreatePostView.perform_create', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        response = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        with patch('posts.idempotency.timezone.now', return_value=timezone.now() + timedelta(seconds=61)):
+            response = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        record = IdempotencyRecord.objects.get()
+        self.assertEqual((record.task_id, record.response_status), ('task-2', 201))
+
+    @override_settings(ASYNC_CREATE=True)
+    @patch('posts.views.moderate_post.apply_async')
+    @patch('posts.idempotency.app.AsyncResult')
+    def test_async_mode_retry_gets_the_original_response(self, mock_async_result, mock_moderate_post):
+        mock_moderate_post.return_value.id = 'task-1'
+        first = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(IdempotencyRecord.objects.get().task_id, 'task-1')
+
+        # a retry that saw the claim in flight waits on the moderation task, then replays the 202
+        IdempotencyRecord.objects.update(response_status=None)
+        cache.clear()
+
+        def moderation_finished(**kwargs):
+            # meanwhile the original request stored its response
+            IdempotencyRecord.objects.update(response_status=202, response_body=first.json())
+            return {'status': ModerationStatus.APPROVED, 'post_id': first.data['post_id']}
+
+        mock_async_result.return_value.get.side_effect = moderation_finished
+        retry = self.client.post(self.url, {'text': 'Some normal text'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        mock_async_result.assert_called_once_with('task-1')
+        self.assertEqual(retry.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Post.objects.count(), 1)
+
+
+@override_settings(ASYNC_CREATE=True)
+class AsyncCreatePostViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('create-post')
+    
+    @patch('posts.views.moderate_post.apply_async')
+    def test_create_post_returns_immediately(self, mock_moderate_post):
+        mock_moderate_post.return_value.id = 'task-id'
+        response = self.client.post(self.url, {'text': 'Some normal text'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        post = Post.objects.get(id=response.data['post_id'])
+        self.assertEqual(post.status, ModerationStatus.PENDING)
+        self.assertEqual(post.owner, self.user)
+        self.assertEqual(response.data['task_id'], 'task-id')
+        mock_moderate_post.assert_called_once_with(args=[post.id])
+        mock_moderate_post.return_value.get.assert_not_called()
+    
+    @patch('posts.views.moderate_post.apply_async')
+    def test_pending_post_is_hidden_from_feed(self, mock_moderate_post):
+        mock_moderate_post.return_value.id = 'task-id'
+        self.client.post(self.url, {'text': 'Some normal text'}, format='json')
+        response = self.client.get(reverse('post-list'))
+        self.assertEqual(len(response.data.get('results')), 0)
+
+
+class ModeratePostTaskTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.post = Post.objects.create(text='Some text', owner=self.user, status=ModerationStatus.PENDING)
+        patcher = patch('posts.broadcast.get_channel_layer')
+        self.channel_layer = patcher.start().return_value
+        self.channel_layer.group_send = AsyncMock()
+        self.addCleanup(patcher.stop)
+    
+    @patch('posts.tasks.check_for_obscence', return_value=True)
+    def test_clean_post_is_approved_and_published(self, mock_check_obscence):
+        result = moderate_post(self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.status, ModerationStatus.APPROVED)
+        self.assertEqual(result['status'], ModerationStatus.APPROVED)
+        event_types = [call.args[1]['type'] for call in self.channel_layer.group_send.call_args_list]
+        self.assertEqual(event_types, ['add_post', 'post_verdict'])
+    
+    @patch('posts.tasks.check_for_obscence', return_value=False)
+    def test_obscene_post_is_rejected(self, mock_check_obscence):
+        moderate_post(self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.status, ModerationStatus.REJECTED)
+        message = self.channel_layer.group_send.call_args.args[1]
+        self.assertEqual(message['type'], 'post_verdict')
+        self.assertEqual(json.loads(message['text'])['verdict']['status'], ModerationStatus.REJECTED)
+
+    @patch('posts.tasks.check_for_obscence', return_value=True)
+    def test_duplicate_moderation_publishes_once(self, mock_check_obscence):
+        # the redelivered task read the post while it was still pending
+        with patch('posts.tasks.Post.objects.select_related') as mock_select_related:
+            mock_select_related.return_value.filter.return_value.first.return_value = Post.objects.get(id=self.post.id)
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                moderate_post(self.post.id)
+                result = moderate_post(self.post.id)
+        self.assertEqual(result['status'], 'fail')
+        self.assertEqual(len(callbacks), 1)  # one 'posts' generation bump
+        event_types = [call.args[1]['type'] for call in self.channel_layer.group_send.call_args_list]
+        self.assertEqual(event_types, ['add_post', 'post_verdict'])
+
+
+class PostStatusViewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.other_user = User.objects.create_user(username='otheruser', password='otherpassword', email='otheruser@gmail.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.post = Post.objects.create(text='Some text', owner=self.user, status=ModerationStatus.PENDING)
+        self.url = reverse('post-status', kwargs={'id': self.post.id})
+    
+    def test_owner_can_poll_status(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'id': self.post.id, 'status': ModerationStatus.PENDING})
+    
+    def test_status_by_non_owner(self):
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+
 class RetrievePostViewTests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword')
@@ -74,6 +336,7 @@ class RetrievePostViewTests(APITestCase):
         
 class ListPostViewTests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.client = APIClient()
         self.client.force_authenticate(user=self.user)
@@ -102,6 +365,124 @@ class ListPostViewTests(APITestCase):
             self.assertIn('id', post)
             self.assertIn('text', post)
             self.assertIn('owner', post)
+
+    def test_order_by_comment_count(self):
+        Post.objects.filter(id=self.post2.id).update(comment_count=2)
+        Post.objects.filter(id__in=[self.post1.id, self.post3.id]).update(comment_count=1)
+        response = self.client.get(self.url, {'ordering': '-comment_count'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # equal counts are ordered by id, in the requested direction
+        self.assertEqual([post['id'] for post in response.data['results']], [self.post2.id, self.post3.id, self.post1.id])
+        self.assertEqual(response.data['results'][0]['comment_count'], 2)
+
+    def test_ordering_with_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'ordering': '-comment_count', 'cursor': ''})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ordering', response.data)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.posts = [Post.objects.create(text=f'Post {i}', owner=self.user) for i in range(12)]
+        # posts with equal created_at must still be paginated without gaps or duplicates
+        Post.objects.filter(id__in=[post.id for post in self.posts[4:8]]).update(created_at=self.posts[4].created_at)
+        self.url = reverse('post-list')
+
+    def test_cursor_pages_cover_every_post_once(self):
+        seen = []
+        response = self.client.get(self.url, {'cursor': '', 'page_size': 5})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [post['id'] for post in response.data['results']]
+            if response.data['next_cursor'] is None:
+                break
+            response = self.client.get(self.url, {'cursor': response.data['next_cursor'], 'page_size': 5})
+        self.assertEqual(seen, [post.id for post in self.posts])
+
+    def test_page_number_mode_still_works(self):
+        response = self.client.get(self.url, {'page': 2, 'page_size': 5})
+        self.assertEqual([post['id'] for post in response.data['results']], [post.id for post in self.posts[5:10]])
+        self.assertNotIn('next_cursor', response.data)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_websocket_feed_is_newest_first(self):
+        posts, next_cursor = get_posts_after()
+        self.assertEqual([post['id'] for post in posts], [post.id for post in self.posts[::-1]])
+        self.assertIsNone(next_cursor)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class PostConsumerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.posts = [Post.objects.create(text=f'Post {i}', owner=self.user) for i in range(30)]
+        Post.objects.create(text='Pending post', owner=self.user, status=ModerationStatus.PENDING)
+    
+    @patch('posts.tasks.get_posts_task.apply_async')
+    async def test_get_posts_reads_db_without_celery(self, mock_get_posts_task):
+        communicator = ApplicationCommunicator(PostConsumer.as_asgi(), websocket_scope('/ws/posts/'))
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+        
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'action': 'get_posts', 'request_id': 1, 'page_num': 1})})
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual(response['event_type'], 'display_post')
+        self.assertEqual(len(response['post']), 25)
+        self.assertEqual(response['post'][0], {'id': self.posts[-1].id, 'username': 'testuser', 'text': 'Post 29'})
+        
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'action': 'get_posts', 'request_id': 2, 'page_num': 2})})
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual([post['id'] for post in response['post']], [post.id for post in self.posts[4::-1]])
+        
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'action': 'get_posts', 'request_id': 3})})
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual(len(response['post']), 25)
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'action': 'get_posts', 'request_id': 4, 'cursor': response['next_cursor']})})
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual([post['id'] for post in response['post']], [post.id for post in self.posts[4::-1]])
+        self.assertIsNone(response['next_cursor'])
+        
+        mock_get_posts_task.assert_not_called()
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+    def edit_post(self, post_id: int, text: str):
+        # the model observer publishes on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.get(id=post_id)
+            post.text = text
+            post.save()
+
+    @override_settings(CHANNEL_LAYERS={
+        'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+        'broadcast': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+    }, BROADCAST_CHANNEL_LAYER='broadcast')
+    async def test_instance_subscriptions_and_broadcasts_use_their_layers(self):
+        communicator = ApplicationCommunicator(PostConsumer.as_asgi(), websocket_scope('/ws/posts/'))
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+
+        # observers publish on the default layer
+        post = self.posts[0]
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'action': 'subscribe_instance', 'request_id': 1, 'pk': post.id})})
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual((response['action'], response['response_status']), ('subscribe_instance', 201))
+        await database_sync_to_async(self.edit_post)(post.id, 'Edited')
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual((response['action'], response['data']['text']), ('update', 'Edited'))
+
+        # the feed group lives on the broadcast layer
+        self.assertTrue(await broadcast.agroup_send('posts_group', {'type': 'add_post', 'text': '{"event_type":"display_post"}'}))
+        self.assertEqual((await communicator.receive_output())['text'], '{"event_type":"display_post"}')
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
             
 
 class UpdatePostViewTests(APITestCase):
@@ -163,4 +544,588 @@ class DeletePostViewTests(APITestCase):
         self.client.force_authenticate(user=self.other_user)
         response = self.client.delete(self.url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
-        self.assertTrue(Post.objects.filter(id=self.post.id).exists())
\ No newline at end of file
+        self.assertTrue(Post.objects.filter(id=self.post.id).exists())
+
+
+class BatchClassifierTests(TestCase):
+    def setUp(self):
+        self.batches = []
+
+    def fake_pipeline(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        return [{'label': 'toxic' if 'bad' in text else 'non-toxic', 'score': 0.9} for text in texts]
+
+    def test_concurrent_texts_share_one_batch(self):
+        classifier = BatchClassifier(self.fake_pipeline, max_batch_size=8, max_wait=0.2)
+        verdicts = classifier.classify_many(['good text', 'bad text', 'another good one'])
+        self.assertEqual(self.batches, [['good text', 'bad text', 'another good one']])
+        self.assertEqual([verdict['label'] for verdict in verdicts], ['non-toxic', 'toxic', 'non-toxic'])
+
+    def test_max_batch_size(self):
+        classifier = BatchClassifier(self.fake_pipeline, max_batch_size=2, max_wait=0.2)
+        classifier.classify_many(['1', '2', '3', '4', '5'])
+        self.assertEqual([len(batch) for batch in self.batches], [2, 2, 1])
+
+    def test_lone_caller_does_not_wait(self):
+        classifier = BatchClassifier(self.fake_pipeline, max_batch_size=8, max_wait=1)
+        started = time.monotonic()
+        classifier.classify('good text')
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_concurrent_callers_share_one_batch(self):
+        def slow_pipeline(texts, **kwargs):
+            time.sleep(0.2)
+            return self.fake_pipeline(texts, **kwargs)
+
+        classifier = BatchClassifier(slow_pipeline, max_batch_size=8, max_wait=1)
+        barrier = threading.Barrier(4)
+
+        def call(text):
+            barrier.wait()
+            classifier.classify(text)
+
+        threads = [threading.Thread(target=call, args=(f'text {i}', )) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # texts submitted while a batch is classified are collected into the next one
+        self.assertEqual(sorted(sum(self.batches, [])), ['text 0', 'text 1', 'text 2', 'text 3'])
+        self.assertLessEqual(len(self.batches), 2)
+
+    def test_pipeline_error_is_raised_for_every_caller(self):
+        def broken_pipeline(texts, **kwargs):
+            raise RuntimeError('model failed')
+
+        classifier = BatchClassifier(broken_pipeline, max_batch_size=8, max_wait=0.01)
+        with self.assertRaises(RuntimeError):
+            classifier.classify('some text')
+
+
+def fake_pipeline_factory():
+    return lambda texts, **kwargs: [{'label': 'non-toxic', 'score': 0.99} for text in texts]
+
+
+class LazyPipelineTests(TestCase):
+    def setUp(self):
+        utils._pipeline = None
+
+    def tearDown(self):
+        utils._pipeline = None
+
+    @override_settings(MODERATION_PIPELINE='posts.tests.fake_pipeline_factory')
+    def test_pipeline_is_loaded_once_on_first_use(self):
+        self.assertIsNone(utils._pipeline)
+        with patch('posts.tests.fake_pipeline_factory', wraps=fake_pipeline_factory) as factory:
+            first = utils.get_pipeline()
+            second = utils.get_pipeline()
+        self.assertIs(first, second)
+        factory.assert_called_once()
+        self.assertEqual(utils.run_pipeline(['some text'])[0]['label'], 'non-toxic')
+
+
+class VerdictCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.verdict_cache = VerdictCache(ttl=60, max_size=2)
+        patcher = patch('posts.utils.verdict_cache', self.verdict_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('posts.utils.classifier.classify', return_value={'label': 'non-toxic', 'score': 0.98})
+    def test_normalized_repeat_skips_inference(self, mock_classify):
+        self.assertTrue(utils.check_for_obscence('Great post!'))
+        self.assertTrue(utils.check_for_obscence('  great   POST! '))
+        mock_classify.assert_called_once_with('Great post!')
+        stats = self.verdict_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['local_hits'], 1)
+
+    @patch('posts.utils.classifier.classify', return_value={'label': 'non-toxic', 'score': 0.98})
+    def test_lookups_are_counted_on_the_current_profile(self, mock_classify):
+        profile = Profile('task', 'run', 'posts.tasks.moderate_post')
+        token = bind_slot(ProfileSlot(profile))
+        try:
+            utils.check_for_obscence('Great post!')
+            utils.check_for_obscence('great post!')
+        finally:
+            unbind_slot(token)
+        self.assertEqual(profile.counters, {'verdict_cache_misses': 1, 'verdict_cache_local_hits': 1})
+
+    @patch('posts.utils.classifier.classify', return_value={'label': 'toxic', 'score': 0.91})
+    def test_shared_tier_is_used_after_local_eviction(self, mock_classify):
+        utils.check_for_obscence('first')
+        utils.check_for_obscence('second')
+        utils.check_for_obscence('third')  # evicts "first" from the local LRU
+        self.assertFalse(utils.check_for_obscence('first'))
+        self.assertEqual(mock_classify.call_count, 3)
+        self.assertEqual(self.verdict_cache.stats()['shared_hits'], 1)
+
+    @patch('posts.utils.classifier.classify', return_value={'label': 'non-toxic', 'score': 0.98})
+    def test_model_version_change_invalidates(self, mock_classify):
+        utils.check_for_obscence('some text')
+        with self.settings(MODERATION_MODEL_VERSION='new-model'):
+            utils.check_for_obscence('some text')
+        self.assertEqual(mock_classify.call_count, 2)
+
+    @patch('posts.utils.classifier.classify_many', side_effect=lambda texts: [{'label': 'non-toxic', 'score': 0.9} for text in texts])
+    def test_classify_many_only_sends_unique_misses(self, mock_classify_many):
+        self.verdict_cache.set('cached', {'label': 'toxic', 'score': 0.9})
+        result = utils.check_many_for_obscence(['cached', 'new', 'NEW', 'other'])
+        self.assertEqual(result, [False, True, True, True])
+        mock_classify_many.assert_called_once_with(['new', 'other'])
+
+
+class PostQueryPlanTests(QueryPlanAssertions, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword', email='test@gmail.com')
+        self.post = Post.objects.create(text='Some text', owner=self.user)
+
+    def test_websocket_feed(self):
+        self.assertUsesIndex(feed_queryset()[:25], 'post_feed_idx')
+
+    def test_websocket_feed_after_cursor(self):
+        self.assertUsesIndex(keyset_queryset(feed_queryset(), encode_cursor(self.post))[:26], 'post_feed_idx')
+
+    def test_list_view(self):
+        self.assertUsesIndex(ListPostView.queryset.all()[:25], 'post_feed_idx')
+
+    def test_list_view_date_range(self):
+        queryset = PostFilter({'date_from': '2024-01-01', 'date_to': '2024-02-01'}, queryset=ListPostView.queryset.all()).qs
+        self.assertUsesIndex(queryset[:25], 'post_feed_idx')
+
+    def test_list_view_owner_filter(self):
+        queryset = PostFilter({'owner': self.user.id}, queryset=ListPostView.queryset.all()).qs
+        self.assertUsesIndex(queryset[:25], 'post_owner_feed_idx')
+
+
+
+class PostQueryCountTests(APITestCase):
+    # every read path must cost a fixed number of queries, whatever the page size
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpassword', email=f'user{i}@gmail.com') for i in range(5)]
+        self.posts = [Post.objects.create(text=f'Post {i}', owner=self.users[i % 5]) for i in range(30)]
+        for post in self.posts[:3]:
+            comment = Comment.objects.create(owner=self.users[0], post=post, text='Some comment')
+            comment_added(post.id, comment.created_at)
+        self.client.force_authenticate(user=self.users[0])
+
+    def test_list_view(self):
+        for page_size in (5, 25):
+            with self.assertNumQueries(2):  # count + page
+                response = self.client.get(reverse('post-list'), {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+        self.assertEqual(response.data['results'][0]['comment_count'], 1)
+        self.assertEqual(response.data['results'][0]['owner']['username'], 'user0')
+
+    def test_list_view_keyset(self):
+        for page_size in (5, 25):
+            with self.assertNumQueries(1):
+                self.client.get(reverse('post-list'), {'page_size': page_size, 'cursor': ''})
+
+    def test_retrieve_view(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('post-details', kwargs={'id': self.posts[0].id}))
+        self.assertEqual(response.data['comment_count'], 1)
+
+    def test_update_view(self):
+        with self.assertNumQueries(2):  # select + update
+            response = self.client.patch(reverse('post-update', kwargs={'id': self.posts[0].id}), {'text': 'Updated'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_websocket_feed(self):
+        with self.assertNumQueries(1):
+            posts = get_posts_page(1)
+        with self.assertNumQueries(1):
+            get_posts_after()
+        self.assertEqual(len(posts), 25)
+
+
+
+class PostSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        get_inverted_index(Post).rebuild()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.post1 = Post.objects.create(text='Django channels and websockets', owner=self.user)
+        self.post2 = Post.objects.create(text='Celery workers, celery queues and celery beat', owner=self.user)
+        self.post3 = Post.objects.create(text='Celery with Django', owner=self.user)
+        self.url = reverse('post-list')
+
+    def test_search_ranks_matches(self):
+        response = self.client.get(self.url, {'search': 'celery'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([post['id'] for post in response.data['results']], [self.post2.id, self.post3.id])
+
+    def test_search_requires_every_term(self):
+        response = self.client.get(self.url, {'search': 'django CELERY'})
+        self.assertEqual([post['id'] for post in response.data['results']], [self.post3.id])
+
+    def test_index_follows_writes(self):
+        self.post1.text = 'Nothing to see here'
+        self.post1.save()
+        Post.objects.create(text='Websockets everywhere', owner=self.user)
+        self.post3.delete()
+        response = self.client.get(self.url, {'search': 'websockets'})
+        self.assertEqual([post['text'] for post in response.data['results']], ['Websockets everywhere'])
+        response = self.client.get(self.url, {'search': 'django'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_search_hides_pending_posts(self):
+        Post.objects.create(text='Pending celery post', owner=self.user, status=ModerationStatus.PENDING)
+        response = self.client.get(self.url, {'search': 'pending'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_index_is_rebuilt_after_writes_of_other_processes(self):
+        self.client.get(self.url, {'search': 'celery'})
+        # e.g. a celery worker: no signal in this process, only the shared generation bump
+        Post.objects.bulk_create([Post(text='Celery from a worker', owner=self.user)])
+        page_cache.bump_generation('posts')
+        response = self.client.get(self.url, {'search': 'worker'})
+        self.assertEqual([post['text'] for post in response.data['results']], ['Celery from a worker'])
+
+    def test_search_cannot_be_combined_with_cursor(self):
+        response = self.client.get(self.url, {'search': 'celery', 'cursor': ''})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('search', response.data)
+
+
+class PageCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.posts = [Post.objects.create(text=f'Post {i}', owner=self.user) for i in range(3)]
+        self.url = reverse('post-list')
+
+    def test_repeated_list_is_served_from_cache(self):
+        self.client.get(self.url, {'page_size': 2})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual([post['id'] for post in response.data['results']], [post.id for post in self.posts[:2]])
+
+    def test_writes_invalidate_every_page(self):
+        self.client.get(self.url, {'page': 2, 'page_size': 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(text='New post', owner=self.user)
+        response = self.client.get(self.url, {'page': 2, 'page_size': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.posts[2].id, post.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = Comment.objects.create(owner=self.user, post=post, text='Some comment')
+            comment_added(post.id, comment.created_at)
+        response = self.client.get(self.url, {'page': 2, 'page_size': 2})
+        self.assertEqual(response.data['results'][1]['comment_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        response = self.client.get(self.url, {'page': 2, 'page_size': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.posts[2].id])
+
+    def test_generation_is_bumped_on_commit(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Post.objects.create(text='New post', owner=self.user)
+            # readers before the commit keep getting the committed page
+            with self.assertNumQueries(0):
+                self.client.get(self.url)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.client.get(self.url).data['results']), 4)
+
+    def test_comment_writes_invalidate_feed_only_on_count_change(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = Comment.objects.create(owner=self.user, post=self.posts[0], text='Pending', status=ModerationStatus.PENDING)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            comment_added(self.posts[0].id, comment.created_at)
+        self.assertEqual(self.client.get(self.url).data['results'][0]['comment_count'], 1)
+
+    def test_websocket_feed_follows_moderation(self):
+        self.assertEqual(len(page_cache.get_or_build(['posts'], 'feed_page', '1', lambda: get_posts_page(1))), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(text='Pending post', owner=self.user, status=ModerationStatus.PENDING)
+            post.status = ModerationStatus.APPROVED
+            post.save(update_fields=['status'])
+        self.assertEqual(len(page_cache.get_or_build(['posts'], 'feed_page', '1', lambda: get_posts_page(1))), 4)
+
+    def test_concurrent_misses_build_once(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.2)
+            return ['page']
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(page_cache.get_or_build(['posts'], 'stampede', 'x', build)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['page']] * 5)
+
+    def test_stats(self):
+        before = page_cache.page_cache_stats()
+        self.client.get(self.url)
+        self.client.get(self.url)
+        stats = page_cache.page_cache_stats()
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+
+
+IN_MEMORY_LAYER = {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+
+
+@override_settings(CHANNEL_LAYERS={'default': IN_MEMORY_LAYER, 'broadcast': IN_MEMORY_LAYER}, BROADCAST_CHANNEL_LAYER='broadcast')
+class BroadcastTests(TestCase):
+    async def test_feed_sockets_join_the_broadcast_layer(self):
+        communicator = ApplicationCommunicator(PostConsumer.as_asgi(), websocket_scope('/ws/posts/'))
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output())['type'], 'websocket.accept')
+
+        self.assertIn('posts_group', get_channel_layer('broadcast').groups)
+        self.assertNotIn('posts_group', get_channel_layer().groups)
+        text = broadcast.encode_frame('display_post', 'post', broadcast.dumps({'id': 1, 'username': 'user', 'text': 'Hi'}))
+        self.assertTrue(await broadcast.agroup_send('posts_group', {'type': 'add_post', 'text': text}))
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual(response['post']['text'], 'Hi')
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+    @override_settings(BROADCAST_CHANNEL_LAYER='missing')
+    def test_falls_back_to_default_layer(self):
+        self.assertEqual(broadcast.broadcast_layer_alias(), 'default')
+
+    @patch('posts.broadcast.get_channel_layer')
+    def test_drops_are_counted(self, mock_get_channel_layer):
+        mock_get_channel_layer.return_value.group_send = AsyncMock(side_effect=ChannelFull())
+        dropped = broadcast.broadcast_stats()['dropped']
+        self.assertFalse(broadcast.group_send('posts_group', {'type': 'add_post'}))
+        self.assertEqual(broadcast.broadcast_stats()['dropped'], dropped + 1)
+
+    @override_settings(BROADCAST_COALESCE_MS=50)
+    @patch('posts.broadcast.group_send')
+    def test_events_are_coalesced_per_group(self, mock_group_send):
+        for i in range(3):
+            broadcast.broadcast_event('posts_group', 'add_post', 'display_post', 'post', {'id': i})
+        broadcast.broadcast_event('post_1', 'add_comment', 'display_comment', 'comment', {'text': 'Hi'})
+        mock_group_send.assert_not_called()
+        time.sleep(0.3)
+        sent = {call.args[0]: call.args[1] for call in mock_group_send.call_args_list}
+        self.assertEqual(sent['posts_group']['type'], 'add_post_batch')
+        self.assertEqual(json.loads(sent['posts_group']['text']), {'event_type': 'display_post', 'post': [{'id': 0}, {'id': 1}, {'id': 2}], 'batch': True})
+        self.assertEqual(sent['post_1']['type'], 'add_comment_batch')
+        self.assertEqual(json.loads(sent['post_1']['text']), {'event_type': 'display_comment', 'comment': [{'text': 'Hi'}], 'batch': True})
+
+    @override_settings(BROADCAST_COALESCE_MS=5000)
+    @patch('posts.broadcast.group_send')
+    def test_frames_follow_buffered_events_of_their_group(self, mock_group_send):
+        broadcast.broadcast_event('posts_group', 'add_post', 'display_post', 'post', {'id': 1})
+        broadcast.broadcast_event('post_1', 'add_comment', 'display_comment', 'comment', {'text': 'Hi'})
+        broadcast.broadcast_frame('posts_group', 'post_verdict', {'event_type': 'post_verdict', 'verdict': {'id': 1}})
+        self.assertEqual([(call.args[0], call.args[1]['type']) for call in mock_group_send.call_args_list],
+                         [('posts_group', 'add_post_batch'), ('posts_group', 'post_verdict')])
+
+        # buffered events of other groups are flushed when the worker process shuts down
+        worker_process_shutdown.send(sender=None, pid=os.getpid(), exitcode=0)
+        self.assertEqual(mock_group_send.call_args.args[:1], ('post_1', ))
+
+    @patch('posts.broadcast.group_send')
+    def test_event_is_encoded_once(self, mock_group_send):
+        broadcast.broadcast_event('posts_group', 'add_post', 'display_post', 'post', {'id': 1, 'text': 'Ünïcode "quoted"'})
+        message = mock_group_send.call_args.args[1]
+        self.assertEqual(json.loads(message['text']), {'event_type': 'display_post', 'post': {'id': 1, 'text': 'Ünïcode "quoted"'}})
+
+    async def test_batch_frame(self):
+        communicator = ApplicationCommunicator(PostConsumer.as_asgi(), websocket_scope('/ws/posts/'))
+        await communicator.send_input({'type': 'websocket.connect'})
+        await communicator.receive_output()
+        text = broadcast.encode_frame('display_post', 'post', '[{"id":1},{"id":2}]', batch=True)
+        await broadcast.agroup_send('posts_group', {'type': 'add_post_batch', 'text': text})
+        response = json.loads((await communicator.receive_output())['text'])
+        self.assertEqual(response, {'event_type': 'display_post', 'post': [{'id': 1}, {'id': 2}], 'batch': True})
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+
+class SlowClient(BackpressureMixin):
+    # socket whose sends block until the test lets them through
+    def __init__(self, policy: str):
+        self.slow_consumer_policy = policy
+        self.sent = []
+        self.closed_with = None
+        self.readable = asyncio.Event()
+
+    async def send(self, text_data):
+        await self.readable.wait()
+        self.sent.append(text_data)
+
+    async def close(self, code=None):
+        self.closed_with = code
+
+
+@override_settings(WS_SEND_QUEUE_HIGH=4, WS_SEND_QUEUE_LOW=2)
+class BackpressureTests(TestCase):
+    async def fill(self, client: SlowClient, count: int):
+        for i in range(count):
+            await client.enqueue(str(i))
+            await asyncio.sleep(0)  # let the writer pick up frames
+        client.readable.set()
+        await asyncio.sleep(0.01)
+
+    async def test_drop_oldest(self):
+        client = SlowClient('drop_oldest')
+        dropped = backpressure_stats().get('SlowClient', {}).get('dropped', 0)
+        await self.fill(client, 10)
+        # frame 0 is in flight, the queue is trimmed to 2 frames whenever it reaches 4
+        self.assertEqual(client.sent, ['0', '7', '8', '9'])
+        self.assertEqual(backpressure_stats()['SlowClient']['dropped'] - dropped, 6)
+        client._writer.cancel()
+
+    async def test_resync(self):
+        client = SlowClient('resync')
+        await self.fill(client, 6)
+        self.assertEqual(client.sent, ['0', '{"event_type":"resync"}', '5'])
+        client._writer.cancel()
+
+    async def test_disconnect(self):
+        client = SlowClient('disconnect')
+        await self.fill(client, 6)
+        self.assertEqual(client.closed_with, 1013)
+        self.assertEqual(client.sent, ['0'])
+        client._writer.cancel()
+
+    async def test_failed_send_stops_the_queue(self):
+        client = SlowClient('drop_oldest')
+        client.send = AsyncMock(side_effect=RuntimeError('socket closed'))
+        await client.enqueue('0')
+        await asyncio.sleep(0)
+        self.assertTrue(client._writer.done())
+        self.assertIsNone(client._writer.exception())
+        await client.enqueue('1')
+        self.assertEqual(len(client._send_queue), 0)
+
+
+class BulkContentTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def write(self, name: str, content: str) -> str:
+        with open(self.path(name), 'w', encoding='utf-8') as f:
+            f.write(content)
+        return self.path(name)
+
+    @patch('posts.bulk.check_many_for_obscence', side_effect=lambda texts: ['bad' not in text for text in texts])
+    def test_import_moderates_in_batches(self, mock_check):
+        path = self.write('posts.csv', (
+            'owner,text,created_at\n'
+            f'{self.user.id},First post,2024-01-01T10:00:00+00:00\n'
+            f'{self.user.id},"Some bad, multi\nline post",\n'
+            f',,\n'
+            f',Anonymous post,2024-01-02T10:00:00\n'
+        ))
+        out = io.StringIO()
+        call_command('import_content', 'posts', path, '--batch-size', '2', stdout=out)
+        self.assertIn('Imported 3 posts (1 rejected by moderation), skipped 1 invalid records.', out.getvalue())
+        self.assertEqual(mock_check.call_count, 2)
+
+        posts = list(Post.objects.order_by('id'))
+        self.assertEqual([post.status for post in posts], [ModerationStatus.APPROVED, ModerationStatus.REJECTED, ModerationStatus.APPROVED])
+        self.assertEqual(posts[1].text, 'Some bad, multi\nline post')
+        self.assertEqual(posts[0].created_at.isoformat(), '2024-01-01T10:00:00+00:00')
+        self.assertIsNone(posts[2].owner)
+
+    def test_export_import_round_trip(self):
+        posts = [Post.objects.create(text=f'Post {i}', owner=self.user) for i in range(3)]
+        Comment.objects.create(owner=self.user, post=posts[1], text='Some comment')
+        call_command('export_content', 'posts', self.path('posts.ndjson'), stdout=io.StringIO())
+        call_command('export_content', 'comments', self.path('comments.csv'), stdout=io.StringIO())
+        # page is cached before the import, the import must invalidate it
+        self.assertEqual(len(self.client.get(reverse('post-list')).data['results']), 3)
+
+        Post.objects.all().delete()
+        for kind, name in (('posts', 'posts.ndjson'), ('comments', 'comments.csv')):
+            call_command('import_content', kind, self.path(name), '--keep-ids', '--skip-moderation', stdout=io.StringIO())
+
+        self.assertEqual(
+            list(Post.objects.order_by('id').values_list('id', 'text', 'created_at')),
+            [(post.id, post.text, post.created_at) for post in posts],
+        )
+        self.assertEqual(Comment.objects.get().post_id, posts[1].id)
+        response = self.client.get(reverse('post-list'))
+        self.assertEqual([post['comment_count'] for post in response.data['results']], [0, 1, 0])
+        # the id sequence continues after the imported ids
+        self.assertGreater(Post.objects.create(text='New post', owner=self.user).id, posts[-1].id)
+
+    def test_unresolvable_records_are_skipped(self):
+        post = Post.objects.create(text='Existing post', owner=self.user)
+        path = self.write('comments.ndjson', (
+            f'{{"id": 100, "post": {post.id}, "owner": {self.user.id}, "text": "First comment"}}\n'
+            '{"id": 101, "post": \n'
+            f'{{"id": 102, "post": {post.id + 1}, "owner": {self.user.id}, "text": "Unknown post"}}\n'
+            f'{{"id": 103, "post": {post.id}, "owner": {self.user.id + 1}, "text": "Unknown owner"}}\n'
+            f'{{"id": 100, "post": {post.id}, "owner": {self.user.id}, "text": "Duplicate id"}}\n'
+            f'{{"id": 104, "post": {post.id}, "text": "Anonymous comment"}}\n'
+        ))
+        out = io.StringIO()
+        call_command('import_content', 'comments', path, '--keep-ids', '--skip-moderation', '--batch-size', '4', stdout=out)
+        self.assertIn('Imported 2 comments (0 rejected by moderation), skipped 4 invalid records.', out.getvalue())
+        self.assertEqual(list(Comment.objects.order_by('id').values_list('id', 'text')), [(100, 'First comment'), (104, 'Anonymous comment')])
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 2)
+
+    def test_raw_insert_of_import_columns(self):
+        # COPY writes only the imported columns, the others need database defaults
+        rows = [clean_record('posts', {'owner': self.user.id, 'text': 'Imported post', 'status': 'approved'}, keep_ids=False)]
+        columns = list(rows[0])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {connection.ops.quote_name(Post._meta.db_table)} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                [rows[0][column] for column in columns],
+            )
+        post = Post.objects.get()
+        self.assertEqual((post.comment_count, post.last_comment_at), (0, None))
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY is PostgreSQL only')
+    def test_copy_import(self):
+        stats = import_records('posts', [{'owner': self.user.id, 'text': 'Imported post'}], moderate=False, use_copy=True)
+        self.assertEqual(stats['imported'], 1)
+        self.assertEqual(Post.objects.get().comment_count, 0)
+
+    def test_export_to_stdout(self):
+        Post.objects.create(text='Approved', owner=self.user)
+        Post.objects.create(text='Rejected', owner=self.user, status=ModerationStatus.REJECTED)
+        out = io.StringIO()
+        call_command('export_content', 'posts', '-', '--status', 'approved', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(row['text'], row['owner'], row['status']) for row in rows], [('Approved', self.user.id, 'approved')])
+
+
+class TaskRoutingTests(TestCase):
+    def test_inference_and_reads_use_separate_queues(self):
+        routes = {
+            'posts.tasks.create_post': ('moderation', 0),
+            'comments.tasks.create_comment': ('moderation', 0),
+            'posts.tasks.moderate_post': ('moderation', 5),
+            'comments.tasks.moderate_comment': ('moderation', 5),
+            'posts.tasks.get_posts_task': ('reads', 0),
+            'comments.tasks.get_comments': ('reads', 0),
+        }
+        for task, (queue, priority) in routes.items():
+            options = app.amqp.router.route({}, task)
+            self.assertEqual((options['queue'].name, options['priority']), (queue, priority), task)
+        self.assertEqual(app.amqp.router.route({}, 'accounts.tasks.flush_expired_tokens')['queue'].name, 'celery')
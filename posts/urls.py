@@ -1,10 +1,11 @@
 from django.urls import path
-from .views import CreatePostView, RetrievePostView, ListPostView, UpdatePostView, DeletePostView
+from .views import CreatePostView, RetrievePostView, ListPostView, PostStatusView, UpdatePostView, DeletePostView
 
 urlpatterns = [
     path('create/', CreatePostView.as_view(), name='create-post'),
     path('details/<int:id>/', RetrievePostView.as_view(), name='post-details'),
     path('list/', ListPostView.as_view(), name='post-list'),
+    path('status/<int:id>/', PostStatusView.as_view(), name='post-status'),
     path('update/<int:id>', UpdatePostView.as_view(), name='post-update'),
     path('delete/<int:id>', DeletePostView.as_view(), name='post-delete'),
     
@@ -1,17 +1,285 @@
-from transformers import BertForSequenceClassification, BertTokenizer, TextClassificationPipeline
-""" 
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from config.metrics import count, staged
+"""
 This file is about using Hugging Face models to create required project functionality
 https://huggingface.co/JungleLee/bert-toxic-comment-classification
 
+The model is loaded lazily on first classification, so processes that never classify
+(e.g. the ASGI web process) don't pay for it. Celery can preload it in the parent
+process (MODERATION_PRELOAD_MODEL) to share the weights copy-on-write with prefork children.
 """
 
-tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
-model = BertForSequenceClassification.from_pretrained("JungleLee/bert-toxic-comment-classification")
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def load_pipeline():
+    # transformers (and torch) are imported here, not at module import time
+    from transformers import BertForSequenceClassification, BertTokenizer, TextClassificationPipeline
+
+    tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
+    model = BertForSequenceClassification.from_pretrained("JungleLee/bert-toxic-comment-classification")
+    model.eval()
+
+    return TextClassificationPipeline(model=model, tokenizer=tokenizer)
+
+
+def get_pipeline():
+    """ Returns the process-wide classification pipeline, loading it on first use
+
+    The factory is taken from settings.MODERATION_PIPELINE (dotted path to a callable
+    returning the pipeline), so tests and benchmarks can plug in a stub.
+    """
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = import_string(settings.MODERATION_PIPELINE)()
+    return _pipeline
+
+
+def run_pipeline(texts: list, **kwargs) -> list:
+    return get_pipeline()(texts, **kwargs)
+
+
+class BatchClassifier:
+    """ Micro-batching wrapper around a text classification pipeline
+
+    Texts submitted by concurrent callers are collected for up to `max_wait` seconds
+    (or until `max_batch_size` texts are pending) and classified with one padded
+    forward pass. Each caller receives the verdict for its own text.
+
+    The wait only happens while other callers of the process haven't submitted their texts
+    yet. A lone caller (e.g. a prefork celery child, which runs one task at a time) is
+    classified right away; batches across callers need a threaded worker pool.
+
+    Args:
+        pipeline: callable accepting a list of texts (HF TextClassificationPipeline)
+        max_batch_size (int): maximum number of texts in one forward pass
+        max_wait (float): how long (in seconds) the first text of a batch waits for company
+    """
+    def __init__(self, pipeline, max_batch_size: int = 32, max_wait: float = 0.005):
+        self.pipeline = pipeline
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self._lock = threading.Lock()
+        self._callers = 0
+        self._pid = None
+        self._queue = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        # threads and queue locks don't survive fork, so every (celery) child process starts its own worker
+        with self._lock:
+            if self._pid != os.getpid() or self._worker is None or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._queue = Queue()
+                self._worker = threading.Thread(target=self._run, args=(self._queue, ), name='batch-classifier', daemon=True)
+                self._worker.start()
+            return self._queue
+
+    def _run(self, queue: Queue):
+        while True:
+            batch = [queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(queue.get_nowait())
+                    continue
+                except Empty:
+                    pass
+                # nobody else is about to submit: waiting would only add latency
+                if len({caller for _, _, caller in batch if caller is not None}) >= self._callers:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(queue.get(timeout=timeout))
+                except Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch: list):
+        texts = [text for text, _, _ in batch]
+        try:
+            results = self.pipeline(texts, batch_size=len(texts), padding=True, truncation=True)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            # pipeline may return [{'label', 'score'}] per text depending on top_k
+            if isinstance(result, list):
+                result = result[0]
+            future.set_result({'label': result.get('label'), 'score': float(result.get('score', 0.0))})
+
+    def submit(self, text: str, caller=None) -> Future:
+        future = Future()
+        self._ensure_worker().put((text, future, caller))
+        return future
+
+    def classify(self, text: str) -> dict:
+        return self.classify_many([text])[0]
+
+    def classify_many(self, texts: list) -> list:
+        caller = object()
+        with self._lock:
+            self._callers += 1
+        try:
+            futures = [self.submit(text, caller) for text in texts]
+            return [future.result() for future in futures]
+        finally:
+            with self._lock:
+                self._callers -= 1
+
+
+classifier = BatchClassifier(
+    run_pipeline,
+    max_batch_size=settings.MODERATION_MAX_BATCH_SIZE,
+    max_wait=settings.MODERATION_MAX_WAIT_MS / 1000,
+)
+
+
+class VerdictCache:
+    """ Two-tier cache of moderation verdicts keyed by a hash of the normalized text
+
+    A small in-process LRU sits in front of the shared Django cache backend. Keys include
+    the model version, so bumping MODERATION_MODEL_VERSION invalidates every stored verdict.
+
+    Lookups are counted per process (stats()) and on the current profile, so the celery
+    workers that classify report them in their TASK_METRICS_FILE records.
+
+    Args:
+        alias (str): Django cache alias used as the shared tier
+        ttl (int): verdict lifetime in seconds (both tiers)
+        max_size (int): maximum number of verdicts kept in the in-process tier
+    """
+    def __init__(self, alias: str = 'default', ttl: int = 86400, max_size: int = 10000):
+        self.alias = alias
+        self.ttl = ttl
+        self.max_size = max_size
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # the tokenizer is uncased, so case and whitespace don't change the verdict
+        return ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+
+    def make_key(self, text: str) -> str:
+        digest = hashlib.sha256(self.normalize(text).encode()).hexdigest()
+        return f'moderation:{settings.MODERATION_MODEL_VERSION}:{digest}'
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+        count(f'verdict_cache_{name}')
+
+    def get(self, text: str):
+        key = self.make_key(text)
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                verdict, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._local.move_to_end(key)
+                    self._stats['local_hits'] += 1
+                    count('verdict_cache_local_hits')
+                    return verdict
+                del self._local[key]
+
+        verdict = caches[self.alias].get(key)
+        if verdict is None:
+            self._count('misses')
+            return None
+
+        self._count('shared_hits')
+        self._remember(key, verdict)
+        return verdict
+
+    def set(self, text: str, verdict: dict):
+        key = self.make_key(text)
+        caches[self.alias].set(key, verdict, self.ttl)
+        self._remember(key, verdict)
+
+    def _remember(self, key: str, verdict: dict):
+        with self._lock:
+            self._local[key] = (verdict, time.monotonic() + self.ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_size'] = len(self._local)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+verdict_cache = VerdictCache(
+    alias=settings.MODERATION_CACHE_ALIAS,
+    ttl=settings.MODERATION_CACHE_TTL,
+    max_size=settings.MODERATION_CACHE_LOCAL_SIZE,
+)
+
+
+@staged('classify')
+def classify(text: str) -> dict:
+    # cache hits skip tokenization and inference entirely
+    verdict = verdict_cache.get(text)
+    if verdict is None:
+        verdict = classifier.classify(text)
+        verdict_cache.set(text, verdict)
+    return verdict
+
+
+@staged('classify')
+def classify_many(texts: list) -> list:
+    verdicts = {}
+    missing = []
+    for text in texts:
+        key = verdict_cache.normalize(text)
+        if key in verdicts:
+            continue
+        verdicts[key] = verdict_cache.get(text)
+        if verdicts[key] is None:
+            missing.append(text)
+
+    for text, verdict in zip(missing, classifier.classify_many(missing)):
+        verdict_cache.set(text, verdict)
+        verdicts[verdict_cache.normalize(text)] = verdict
+
+    return [verdicts[verdict_cache.normalize(text)] for text in texts]
+
+
+def is_clean(verdict: dict) -> bool:
+    return verdict.get('label') != 'toxic'
 
-pipeline = TextClassificationPipeline(model=model, tokenizer=tokenizer)
 
 def check_for_obscence(text: str) -> bool:
-    
-    
-    is_toxic = pipeline(text)[0].get('label')
-    return is_toxic != 'toxic'
\ No newline at end of file
+    return is_clean(classify(text))
+
+
+def check_many_for_obscence(texts: list) -> list:
+    return [is_clean(verdict) for verdict in classify_many(texts)]
@@ -1,19 +1,23 @@
+from django.conf import settings
 from django.shortcuts import render
-from rest_framework import generics, status, serializers 
+from rest_framework import generics, serializers 
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.response import Response
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from accounts.authentication import CachedJWTAuthentication
+from config.metrics import stage
 from django_filters.rest_framework import DjangoFilterBackend
 
 from accounts.models import User
 from accounts.utils import error_detail
 from .permissions import IsOwner
-from .models import Post
-from .serializers import PostSerializer, CreatePostSerializer
-from .utils import check_for_obscence
-from .filters import PostFilter
-from .tasks import create_post
-from .pagination import ItemPagination
+from .models import Post, ModerationStatus
+from .serializers import PostSerializer, CreatePostSerializer, PostStatusSerializer
+from .filters import PostFilter, StableOrderingFilter
+from .tasks import create_post, moderate_post
+from .pagination import KeysetPagination
+from .search import FullTextSearchFilter
+from .queries import post_queryset, approved_posts
+from .page_cache import CachedListMixin
+from .idempotency import IdempotentCreateMixin
 
 def auth(request):
     return render(request, template_name='auth.html')
@@ -25,55 +29,76 @@ def post_details(request, id):
     return render(request, context={'post_id': id}, template_name='post_details.html')
 
 # Create your views here.
-class CreatePostView(generics.CreateAPIView):
+class CreatePostView(IdempotentCreateMixin, generics.CreateAPIView):
     queryset = Post.objects.all()
     serializer_class = CreatePostSerializer
-    authentication_classes = (JWTAuthentication, )
+    authentication_classes = (CachedJWTAuthentication, )
     permission_classes = (IsAuthenticated, )
 
     def perform_create(self, serializer):
+        if settings.ASYNC_CREATE:
+            return self.perform_async_create(serializer)
         post_data = serializer.validated_data
         owner_id = self.request.user.id
-        result = create_post.apply_async(args=[owner_id, post_data]).get()
+        task = create_post.apply_async(args=[owner_id, post_data])
+        self.task_started(task)
+        with stage('task_wait'):
+            result = task.get()
        
         return result
     
+    # store the post as "pending" and let celery moderate it, without waiting for the verdict
+    def perform_async_create(self, serializer):
+        post = serializer.save(owner=self.request.user, status=ModerationStatus.PENDING)
+        task = moderate_post.apply_async(args=[post.id])
+        self.task_started(task)
+        return {'status': 'pending', 'detail': 'Post is pending moderation.', 'post_id': post.id, 'task_id': task.id}
+    
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         response_data = self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
-        if response_data.get('status') == 'success':
-            return Response(data=response_data, status=status.HTTP_201_CREATED, headers=headers)    
-        else:
-            return Response(data=response_data, status=status.HTTP_400_BAD_REQUEST, headers=headers)
+        return self.response_for(response_data, headers)
 
             
 
 class RetrievePostView(generics.RetrieveAPIView):
-    queryset = Post.objects.all()
+    queryset = approved_posts()
     serializer_class = PostSerializer
     lookup_field = 'id'
     
 
-class ListPostView(generics.ListAPIView):
-    queryset = Post.objects.all().order_by('created_at')
+class ListPostView(CachedListMixin, generics.ListAPIView):
+    queryset = approved_posts().order_by('created_at')
     serializer_class = PostSerializer
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, StableOrderingFilter]
     filterset_class = PostFilter
-    pagination_class = ItemPagination
+    # e.g. ?ordering=-comment_count (page number mode only, rejected together with ?cursor=)
+    ordering_fields = ['created_at', 'comment_count', 'last_comment_at']
+    pagination_class = KeysetPagination
+    cache_scopes = ('posts', )
     
     
-class UpdatePostView(generics.UpdateAPIView):
+# moderation status of own post (for clients without websocket)
+class PostStatusView(generics.RetrieveAPIView):
     queryset = Post.objects.all()
+    serializer_class = PostStatusSerializer
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated, IsOwner]
+    lookup_field = 'id'
+    
+    
+class UpdatePostView(generics.UpdateAPIView):
+    queryset = post_queryset()
     serializer_class = PostSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated, IsOwner]
     lookup_field = 'id'
     
 class DeletePostView(generics.DestroyAPIView):
-    queryset = Post.objects.all()
+    queryset = post_queryset()
     serializer_class = PostSerializer
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated, IsOwner]
     lookup_field = 'id'
\ No newline at end of file